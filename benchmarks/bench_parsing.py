@@ -0,0 +1,191 @@
+"""
+Micro-benchmark of the response parser in `src/parsing.py` against the
+markdown -> HTML -> BeautifulSoup implementation it replaces.
+
+The benchmark runs both implementations over a corpus of recorded LLM
+responses, checks that they extract the same questions and answers, and
+reports the time each of them takes. The responses of the corpus with a
+`legacy_differs` field are parsed differently on purpose (the field gives the
+reason), so their outputs are reported but not compared.
+
+The reference implementation needs `pip install markdown beautifulsoup4`,
+which the application itself no longer requires.
+
+Usage:
+    python benchmarks/bench_parsing.py [--repeat REPEAT] [--corpus CORPUS]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+from typing import Any, Dict, List, Optional, Sequence
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import parsing  # noqa: E402
+
+NEGATIVE_RESPONSE = "I can't"
+MAX_NUMBER_OF_ANSWERS = 5
+
+
+# ----- reference implementation (before `src/parsing.py`) -----
+
+
+def legacy_remove_markdown(text: str) -> str:
+    from bs4 import BeautifulSoup
+    from markdown import markdown
+
+    html = markdown(text)
+    return "".join(BeautifulSoup(html, "html.parser").findAll(string=True))
+
+
+def legacy_extract_questions(
+    llm_response: str, negative_response: str, download: bool
+) -> List[str]:
+    import nltk
+    from nltk.tokenize import sent_tokenize
+
+    if negative_response.lower() in llm_response.lower():
+        return []
+
+    llm_response_no_markdown = legacy_remove_markdown(llm_response)
+    llm_response_no_boiler_plate = llm_response_no_markdown.replace(
+        ":\n\n", ".\n"
+    )
+    llm_response_no_references = re.sub(
+        r"\(.*\) *\n+", "", llm_response_no_boiler_plate
+    )
+
+    if download:
+        nltk.download("punkt", quiet=True, force=False, raise_on_error=True)
+
+    return [
+        sentence
+        for sentence in sent_tokenize(llm_response_no_references)
+        if sentence.endswith("?")
+    ]
+
+
+def legacy_extract_answers(
+    llm_response: str, *, negative_response: str, max_number_of_answers
+) -> List[str]:
+    if negative_response.lower() in llm_response.lower():
+        return []
+
+    llm_response_no_markdown = legacy_remove_markdown(llm_response)
+
+    answers = [
+        sentence.strip()
+        for sentence in llm_response_no_markdown.split("\n")
+        if re.match(r"^\s*[a-zA-Z]\s*\)", sentence)
+    ]
+
+    return answers[: min(max_number_of_answers, len(answers))]
+
+
+# ----- benchmark -----
+
+
+def run_legacy(responses: List[Dict[str, Any]], download: bool) -> List[Any]:
+    return [
+        (
+            legacy_extract_questions(
+                response["text"], NEGATIVE_RESPONSE, download
+            )
+            if response["kind"] == "questions"
+            else legacy_extract_answers(
+                response["text"],
+                negative_response=NEGATIVE_RESPONSE,
+                max_number_of_answers=MAX_NUMBER_OF_ANSWERS,
+            )
+        )
+        for response in responses
+    ]
+
+
+def run_parser(responses: List[Dict[str, Any]]) -> List[Any]:
+    return [
+        (
+            parsing.extract_questions(response["text"], NEGATIVE_RESPONSE)
+            if response["kind"] == "questions"
+            else parsing.extract_answers(
+                response["text"],
+                negative_response=NEGATIVE_RESPONSE,
+                max_number_of_answers=MAX_NUMBER_OF_ANSWERS,
+            )
+        )
+        for response in responses
+    ]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--corpus",
+        help="JSON file with the recorded responses",
+        default=os.path.join(
+            os.path.dirname(__file__), "data", "responses.json"
+        ),
+    )
+    parser.add_argument(
+        "--repeat",
+        help="Number of passes over the corpus",
+        type=int,
+        default=200,
+    )
+    parser.add_argument(
+        "--legacy-download",
+        action="store_true",
+        help="Call `nltk.download` on every legacy question extraction, "
+        "as the replaced implementation did (needs network access)",
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.corpus, encoding="utf-8") as f:
+        responses = json.load(f)
+
+    # warm up both implementations (imports, tokenizer data)
+    legacy_outputs = run_legacy(responses, args.legacy_download)
+    parser_outputs = run_parser(responses)
+
+    mismatches = 0
+    known_differences = 0
+    for response, expected, actual in zip(
+        responses, legacy_outputs, parser_outputs
+    ):
+        if "legacy_differs" in response:
+            known_differences += 1
+            print(f"Known difference ({response['legacy_differs']}):")
+            print(f"  legacy: {expected}\n  parser: {actual}")
+        elif expected != actual:
+            mismatches += 1
+            print(f"Mismatch for response:\n{response['text']}")
+            print(f"  legacy: {expected}\n  parser: {actual}")
+
+    legacy_time = timeit.timeit(
+        lambda: run_legacy(responses, args.legacy_download),
+        number=args.repeat,
+    )
+    parser_time = timeit.timeit(
+        lambda: run_parser(responses), number=args.repeat
+    )
+
+    number_of_calls = len(responses) * args.repeat
+    print(f"Responses: {len(responses)}, passes: {args.repeat}")
+    print(f"Legacy: {legacy_time / number_of_calls * 1e6:10.1f} us/response")
+    print(f"Parser: {parser_time / number_of_calls * 1e6:10.1f} us/response")
+    print(f"Speedup: {legacy_time / parser_time:.1f}x")
+    number_of_compared = len(responses) - known_differences
+    print(
+        f"Matching outputs: {number_of_compared - mismatches}/"
+        f"{number_of_compared} ({known_differences} known differences)"
+    )
+
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""
+Benchmark of the resilient call layer in `src/resilience.py` against a local
+fake backend with injected latency spikes and outages.
+
+The benchmark compares the latencies of plain calls with those of hedged
+calls, checks that a hanging request or stream is abandoned at its deadline,
+and checks that the circuit breaker stops calling a backend during an outage.
+
+Usage:
+    python benchmarks/bench_resilience.py [--calls CALLS] [--seed SEED]
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from typing import Iterator, List, Optional, Sequence
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from resilience import (  # noqa: E402
+    CallTimeout,
+    CircuitBreaker,
+    CircuitOpen,
+    LatencyTracker,
+    ResilientCaller,
+)
+
+
+class FakeBackend:
+    """
+    Backend answering after a random latency, with occasional spikes.
+
+    Args
+    ----
+    latency (float): Usual latency in seconds.
+    spike_probability (float): Probability of a latency spike.
+    spike_latency (float): Latency of a spike in seconds.
+    seed (int): Seed of the random latencies.
+    """
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.02,
+        spike_probability: float = 0.03,
+        spike_latency: float = 1.0,
+        seed: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.spike_probability = spike_probability
+        self.spike_latency = spike_latency
+        self.failing = False
+        self.number_of_requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        # the first token arrives after the latency of a request
+        yield from self.request(prompt)
+
+    def request(self, prompt: str) -> str:
+        with self._lock:
+            self.number_of_requests += 1
+            failing = self.failing
+            spike = self._random.random() < self.spike_probability
+            jitter = self._random.uniform(0.5, 1.5)
+        if failing:
+            time.sleep(self.latency)
+            raise ConnectionError("backend unavailable")
+        time.sleep(self.spike_latency if spike else self.latency * jitter)
+        return prompt.upper()
+
+
+def percentile(latencies: List[float], fraction: float) -> float:
+    latencies = sorted(latencies)
+    return latencies[min(int(fraction * len(latencies)), len(latencies) - 1)]
+
+
+def measure(caller: ResilientCaller, backend: FakeBackend, calls: int):
+    latencies = []
+    for i in range(calls):
+        start_time = time.perf_counter()
+        caller.call(backend.request, f"prompt {i}")
+        latencies.append(time.perf_counter() - start_time)
+    return latencies
+
+
+def report(name: str, latencies: List[float], requests: int) -> None:
+    print(
+        f"{name:>7}: p50 {percentile(latencies, 0.5) * 1000:7.1f} ms, "
+        f"p95 {percentile(latencies, 0.95) * 1000:7.1f} ms, "
+        f"p99 {percentile(latencies, 0.99) * 1000:7.1f} ms, "
+        f"max {max(latencies) * 1000:7.1f} ms, "
+        f"total {sum(latencies):5.2f} s, {requests} requests"
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--calls", help="Number of calls", type=int, default=300
+    )
+    parser.add_argument(
+        "--seed", help="Seed of the fake backend", type=int, default=0
+    )
+    args = parser.parse_args(argv)
+    ok = True
+
+    # hedging: a duplicate request is sent once a call is slower than the
+    # p95 latency, so the spikes cost about p95 instead of the spike latency
+    plain_backend = FakeBackend(seed=args.seed)
+    plain = measure(
+        ResilientCaller(timeout=None, hedge_percentile=None),
+        plain_backend,
+        args.calls,
+    )
+    hedged_backend = FakeBackend(seed=args.seed)
+    hedged_caller = ResilientCaller(
+        timeout=None,
+        hedge_percentile=0.95,
+        min_hedge_delay=0.0,
+        latency_tracker=LatencyTracker(min_samples=20),
+    )
+    hedged = measure(hedged_caller, hedged_backend, args.calls)
+    report("plain", plain, plain_backend.number_of_requests)
+    report("hedged", hedged, hedged_backend.number_of_requests)
+    # the first calls are not hedged until enough latencies are known
+    if percentile(hedged[20:], 0.99) >= percentile(plain[20:], 0.99):
+        print("Hedging did not reduce the p99 latency")
+        ok = False
+
+    # deadline: a hanging request is abandoned
+    hanging_backend = FakeBackend(spike_probability=1.0, spike_latency=5.0)
+    start_time = time.perf_counter()
+    try:
+        ResilientCaller(timeout=0.2, hedge_percentile=None).call(
+            hanging_backend.request, "prompt"
+        )
+        print("The hanging request was not abandoned")
+        ok = False
+    except CallTimeout:
+        elapsed = time.perf_counter() - start_time
+        print(f"deadline: hanging request abandoned after {elapsed:.2f} s")
+        if elapsed > 1.0:
+            ok = False
+
+    # the same deadline applies to the first token of a stream
+    start_time = time.perf_counter()
+    try:
+        next(
+            ResilientCaller(timeout=0.2, hedge_percentile=None).stream(
+                hanging_backend.stream, "prompt"
+            )
+        )
+        print("The hanging stream was not abandoned")
+        ok = False
+    except CallTimeout:
+        elapsed = time.perf_counter() - start_time
+        print(f"deadline: hanging stream abandoned after {elapsed:.2f} s")
+        if elapsed > 1.0:
+            ok = False
+
+    # circuit breaker: during an outage the backend is called only until
+    # the circuit opens, then once per reset timeout
+    outage_backend = FakeBackend(spike_probability=0.0)
+    outage_backend.failing = True
+    caller = ResilientCaller(
+        timeout=1.0,
+        hedge_percentile=None,
+        circuit_breaker=CircuitBreaker(
+            failure_threshold=3, reset_timeout=0.1
+        ),
+    )
+    fast_failures = 0
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < 0.5:
+        try:
+            caller.call(outage_backend.request, "prompt")
+        except CircuitOpen:
+            fast_failures += 1
+            time.sleep(0.01)
+        except ConnectionError:
+            pass
+    outage_requests = outage_backend.number_of_requests
+    outage_backend.failing = False
+    time.sleep(0.5)
+    recovered = caller.call(outage_backend.request, "prompt") == "PROMPT"
+    print(
+        f"circuit breaker: {outage_requests} requests and {fast_failures} "
+        f"fast failures in a 0.5 s outage, recovered: {recovered}"
+    )
+    # 3 failures open the circuit, then probes at 0.1, 0.3 s (doubling)
+    if outage_requests > 6 or not recovered:
+        ok = False
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
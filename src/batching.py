@@ -0,0 +1,118 @@
+"""
+Batching of several questions of a topic into a single LLM prompt.
+
+The questions of a batch are numbered in the prompt, and the LLM is asked to
+reply to each question in a section starting with a marker line holding its
+number, so the response can be split back into one reply per question.
+"""
+
+import re
+from typing import Callable, List, Optional, Sequence, TypeVar
+
+from budget import estimate_tokens
+
+T = TypeVar("T")
+
+# optional markdown emphasis or heading around '=== 1 ==='
+_SECTION_MARKER = re.compile(
+    r"^[ \t]*[#*_]*[ \t]*={3}[ \t]*(\d+)[ \t]*={3}[ \t]*[*_]*[ \t]*$",
+    re.MULTILINE,
+)
+
+
+def format_section_marker(number: int) -> str:
+    return f"=== {number} ==="
+
+
+def section_instructions(number_of_items: int) -> str:
+    return (
+        f"Reply to each of the {number_of_items} questions in its own "
+        "section, in order. Start the section of a question with a line "
+        f"containing only its number between '===' (for example, "
+        f"{format_section_marker(1)!r}), followed by your reply to that "
+        "question only."
+    )
+
+
+def split_sections(
+    llm_response: str, number_of_items: int
+) -> List[Optional[str]]:
+    """
+    Split a batched LLM response into the reply to each item.
+
+    Args
+    ----
+    llm_response (str): LLM response with one section per item.
+    number_of_items (int): Number of items in the batch.
+
+    Returns
+    -------
+    List[Optional[str]]
+        Reply to each item, or None for the items without a section (or
+        with an empty or repeated section).
+    """
+    replies: List[Optional[str]] = [None] * number_of_items
+    seen = set()
+    markers = list(_SECTION_MARKER.finditer(llm_response))
+    for marker, next_marker in zip(markers, markers[1:] + [None]):
+        number = int(marker.group(1))
+        end = len(llm_response) if next_marker is None else next_marker.start()
+        reply = llm_response[marker.end(): end].strip()
+        if not 1 <= number <= number_of_items:
+            continue
+        if number in seen:
+            # an item answered twice is ambiguous
+            replies[number - 1] = None
+            continue
+        seen.add(number)
+        replies[number - 1] = reply or None
+    return replies
+
+
+def make_batches(
+    items: Sequence[T],
+    *,
+    build_prompt: Callable[[List[T]], str],
+    output_tokens_per_item: int,
+    max_tokens: int,
+    context_tokens: int = 0,
+) -> List[List[T]]:
+    """
+    Group consecutive items into batches that fit in a token budget.
+
+    A batch grows as long as the estimated tokens of its prompt, plus the
+    tokens added to every prompt and the expected output tokens of its
+    items, stay within `max_tokens`. An item that does not fit on its own
+    forms a batch by itself.
+
+    Args
+    ----
+    items (Sequence[T]): Items, in order.
+    build_prompt (Callable[[List[T]], str]): Prompt of a batch.
+    output_tokens_per_item (int): Expected number of output tokens per item.
+    max_tokens (int): Maximum number of tokens per batch.
+    context_tokens (int): Tokens added to the prompt of every batch, such\
+        as the retrieved context and the prompt template of the chain.
+
+    Returns
+    -------
+    List[List[T]]
+        Batches, in order.
+    """
+    batches: List[List[T]] = []
+    batch: List[T] = []
+    for item in items:
+        candidate = batch + [item]
+        tokens = (
+            context_tokens
+            + estimate_tokens(build_prompt(candidate))
+            + output_tokens_per_item * len(candidate)
+        )
+        if batch and tokens > max_tokens:
+            batches.append(batch)
+            batch = [item]
+        else:
+            batch = candidate
+    if batch:
+        batches.append(batch)
+    return batches
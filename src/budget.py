@@ -0,0 +1,175 @@
+"""
+Run-level budgets for the LLM calls.
+
+The budget of a run is activated once, and every LLM call checks it before
+being issued and is charged to it afterwards, so the run stops with
+`BudgetExhausted` once a limit is reached.
+"""
+
+import contextlib
+import time
+from typing import Iterator, Optional
+
+
+class BudgetExhausted(Exception):
+    """
+    Raised when an LLM call is attempted after the budget ran out.
+    """
+
+
+def estimate_tokens(text: str) -> int:
+    # about 4 characters per token for English text
+    return (len(text) + 3) // 4
+
+
+class Budget:
+    """
+    Limits on the LLM calls of a run.
+
+    Args
+    ----
+    max_calls (Optional[int]): Maximum number of LLM calls.
+    max_tokens (Optional[int]): Maximum number of (estimated) input and\
+        output tokens.
+    max_seconds (Optional[float]): Maximum number of seconds since the\
+        budget was created.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_calls: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        max_seconds: Optional[float] = None,
+    ) -> None:
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.calls = 0
+        self.tokens = 0
+        self.start_time = time.monotonic()
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return time.monotonic() - self.start_time
+
+    @property
+    def remaining_seconds(self) -> Optional[float]:
+        if self.max_seconds is None:
+            return None
+        return max(self.max_seconds - self.elapsed_seconds, 0.0)
+
+    def exhausted_reason(self) -> Optional[str]:
+        """
+        Get the reason the budget is exhausted.
+
+        Returns
+        -------
+        Optional[str]
+            Limit that was reached, or None if the budget is not exhausted.
+        """
+        if self.max_calls is not None and self.calls >= self.max_calls:
+            return f"reached the maximum of {self.max_calls} LLM calls"
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return f"reached the maximum of {self.max_tokens} tokens"
+        if (
+            self.max_seconds is not None
+            and self.elapsed_seconds >= self.max_seconds
+        ):
+            return f"reached the maximum of {self.max_seconds} seconds"
+        return None
+
+    def check(self) -> None:
+        """
+        Raise `BudgetExhausted` if the budget is exhausted.
+        """
+        if (reason := self.exhausted_reason()) is not None:
+            raise BudgetExhausted(reason)
+
+    def charge(self, *, calls: int = 1, tokens: int = 0) -> None:
+        self.calls += calls
+        self.tokens += tokens
+
+    def summary(self) -> str:
+        return (
+            f"{self.calls} LLM calls, about {self.tokens} tokens, "
+            f"{self.elapsed_seconds:.0f} seconds"
+        )
+
+
+_active_budget: Optional[Budget] = None
+
+
+@contextlib.contextmanager
+def activate_budget(budget: Budget) -> Iterator[Budget]:
+    """
+    Charge the LLM calls made in the context to the budget.
+
+    Args
+    ----
+    budget (Budget): Budget of the run.
+
+    Returns
+    -------
+    Iterator[Budget]
+        Context yielding the budget.
+    """
+    global _active_budget
+    previous_budget = _active_budget
+    _active_budget = budget
+    try:
+        yield budget
+    finally:
+        _active_budget = previous_budget
+
+
+def check_budget() -> None:
+    """
+    Raise `BudgetExhausted` if the active budget is exhausted.
+    """
+    if _active_budget is not None:
+        _active_budget.check()
+
+
+def sleep_within_budget(seconds: float) -> None:
+    """
+    Sleep, unless the run time of the active budget would run out meanwhile.
+
+    Args
+    ----
+    seconds (float): Number of seconds to sleep.
+
+    Raises
+    ------
+    BudgetExhausted
+        If the active budget is exhausted, or the sleep would last longer
+        than its remaining run time (without sleeping).
+    """
+    check_budget()
+    if _active_budget is not None:
+        remaining_seconds = _active_budget.remaining_seconds
+        if remaining_seconds is not None:
+            if seconds > remaining_seconds:
+                raise BudgetExhausted(
+                    f"waiting {seconds:.0f} seconds would exceed the "
+                    f"maximum of {_active_budget.max_seconds} seconds"
+                )
+    time.sleep(seconds)
+
+
+def charge_llm_call(*texts: str, requests: int = 1) -> None:
+    """
+    Charge an LLM call to the active budget.
+
+    Args
+    ----
+    texts (str): Input and output texts of the call.
+    requests (int): Number of requests sent for the call, each of them\
+        charged as a call with these texts (a hedged call sends duplicate\
+        requests).
+    """
+    if _active_budget is not None:
+        _active_budget.charge(
+            calls=requests,
+            tokens=requests * sum(estimate_tokens(text) for text in texts),
+        )
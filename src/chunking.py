@@ -0,0 +1,93 @@
+"""
+Chunking of the loaded pages for embedding.
+
+Slides are short, so consecutive pages of the same source are merged into
+chunks of up to `chunk_size` characters, and only the pages longer than that
+are split.
+"""
+
+from typing import Any, Dict, List
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents.base import Document
+
+PAGE_SEPARATOR = "\n\n"
+
+
+def _merge_pages(pages: List[Document]) -> Document:
+    metadata: Dict[str, Any] = dict(pages[0].metadata)
+    # flags (such as the topics of the pages) are set if any page sets them
+    for page in pages[1:]:
+        for key, value in page.metadata.items():
+            if value is True:
+                metadata[key] = True
+    if "page" in metadata:
+        metadata["page_end"] = pages[-1].metadata.get("page", metadata["page"])
+    return Document(
+        page_content=PAGE_SEPARATOR.join(page.page_content for page in pages),
+        metadata=metadata,
+    )
+
+
+def chunk_pages(
+    documents: List[Document],
+    *,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 100,
+) -> List[Document]:
+    """
+    Split the pages into chunks that respect the page boundaries.
+
+    Consecutive pages of the same source are merged as long as the merged
+    chunk is at most `chunk_size` characters long. Pages longer than that are
+    split on their own, with `chunk_overlap` characters of overlap.
+
+    Args
+    ----
+    documents (List[Document]): Pages, in order.
+    chunk_size (int): Maximum number of characters in a chunk.
+    chunk_overlap (int): Number of characters shared by consecutive chunks\
+        of a split page.
+
+    Returns
+    -------
+    List[Document]
+        Chunks. The 'page' metadata of a chunk is its first page, and its
+        'page_end' metadata is its last page.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+
+    chunks: List[Document] = []
+    pages: List[Document] = []
+    length = 0
+
+    def flush() -> None:
+        nonlocal length
+        if pages:
+            chunks.append(_merge_pages(pages))
+            pages.clear()
+            length = 0
+
+    for document in documents:
+        page_length = len(document.page_content)
+        if page_length > chunk_size:
+            flush()
+            for chunk in text_splitter.split_documents([document]):
+                chunks.append(_merge_pages([chunk]))
+            continue
+
+        same_source = not pages or pages[-1].metadata.get(
+            "source"
+        ) == document.metadata.get("source")
+        if not same_source or (
+            length + len(PAGE_SEPARATOR) + page_length > chunk_size
+        ):
+            flush()
+
+        length += page_length + (len(PAGE_SEPARATOR) if pages else 0)
+        pages.append(document)
+
+    flush()
+    return chunks
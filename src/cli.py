@@ -5,19 +5,55 @@ Generate questions from PDF file.
 import argparse
 import os
 import sys
-from typing import Optional, Sequence
+from typing import Any, Dict, List, Optional, Sequence
 
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFDirectoryLoader
 
+from budget import Budget, BudgetExhausted, activate_budget
+from deduplication import MinHashLSH
 from generation import (
-    generate_correct_answers,
-    generate_multi_choice_answers,
-    generate_questions,
     extract_and_translate_topics,
+    generate_topics_by_priority,
+)
+from ocr import DEFAULT_OCR_CACHE_DIRECTORY, load_pdf_files, load_pdfs
+from preprocessing import remove_boilerplate
+from models import (
+    DEFAULT_LLM_MODEL,
+    DEFAULT_STAGE_MAX_OUTPUT_TOKENS,
+    STAGE_DESCRIPTIONS,
+    STAGES,
+    TOPICS,
+    get_stage_model_configs,
+)
+from rag import get_stage_retrieval_qa_chains, get_vector_store
+from resilience import (
+    EMBEDDING_CALLS,
+    LLM_CALLS,
+    BackendUnavailable,
+    CircuitBreaker,
+    configure_backend,
+)
+from topic_extraction import (
+    TOPIC_LABELERS,
+    TOPIC_PRIORITIES,
+    assign_topics_to_documents,
+    infer_document_topics,
+    rank_topics,
+)
+from response_processing import (
+    OUTPUT_FORMATS,
+    QuestionExporter,
+    get_partial_file_path,
+    load_exported_questions,
+)
+from utils import translate_non_english_page_contents
+from watch import (
+    FileChanges,
+    FileState,
+    QuestionBank,
+    snapshot_pdf_files,
+    wait_for_file_changes,
 )
-from rag import get_retrieval_qa_chain
-from response_processing import export_questions_and_answers
 
 
 def get_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
@@ -50,6 +86,32 @@ def get_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
         type=str,
         default="questions_and_answers.json",
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Recover the questions exported by an interrupted run with the "
+        "same output file, instead of discarding them",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="After generating the questions, keep watching the PDF "
+        "directory and update the questions of the topics whose pages "
+        "changed in the output file",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        help="Seconds between two checks of the PDF directory in watch mode",
+        type=float,
+        default=10.0,
+    )
+    parser.add_argument(
+        "--output-format",
+        help="Format of the output file: indented JSON, JSON without "
+        "whitespace, or JSON Lines with one question per line",
+        choices=OUTPUT_FORMATS,
+        default="json",
+    )
 
     parser.add_argument(
         "--verbose",
@@ -66,6 +128,40 @@ def get_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
         help="Extract text from images in the PDF (slower, "
         "requires `pip install rapidocr-onnxruntime`)",
     )
+    pdf_options.add_argument(
+        "--min-image-area",
+        help="Images with fewer pixels are skipped when extracting text from "
+        "images",
+        type=int,
+        default=2500,
+    )
+    pdf_options.add_argument(
+        "--ocr-workers",
+        help="Number of processes extracting text from images "
+        "(number of CPUs by default)",
+        type=int,
+        default=None,
+    )
+    pdf_options.add_argument(
+        "--ocr-cache-directory",
+        help="Directory of the cache of the text extracted from images",
+        type=str,
+        default=DEFAULT_OCR_CACHE_DIRECTORY,
+    )
+    pdf_options.add_argument(
+        "--duplicate-page-threshold",
+        help="Similarity (between 0 and 1) above which two pages are "
+        "near-duplicates, only the first page of each group of "
+        "near-duplicates is kept",
+        type=float,
+        default=0.8,
+    )
+    pdf_options.add_argument(
+        "--keep-boilerplate",
+        action="store_true",
+        help="Keep the near-duplicate pages and the lines repeated across "
+        "most pages of a PDF (such as headers and footers)",
+    )
     lda_options = parser.add_argument_group("LDA options")
     lda_options.add_argument(
         "--number-of-topics",
@@ -83,19 +179,79 @@ def get_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
         type=int,
         default=5,
     )
+    lda_options.add_argument(
+        "--topic-labels",
+        help="How to name the topics: ask the LLM (slower, better names), "
+        "or use the top phrases of each topic (instant, works offline)",
+        choices=TOPIC_LABELERS,
+        default="llm",
+    )
+    lda_options.add_argument(
+        "--no-topic-filter",
+        action="store_true",
+        help="Retrieve the context for each topic from all the pages, "
+        "instead of only from the pages of the topic",
+    )
+
+    budget_options = parser.add_argument_group(
+        "Budget options",
+        "Limits of the run. The topics are generated in the order of "
+        "--topic-priority, and once a limit is reached the run stops and "
+        "the questions generated so far are saved",
+    )
+    budget_options.add_argument(
+        "--max-llm-calls",
+        help="Maximum number of LLM calls (no limit by default)",
+        type=int,
+        default=None,
+    )
+    budget_options.add_argument(
+        "--max-tokens",
+        help="Maximum number of input and output tokens, estimated from "
+        "the length of the texts (no limit by default)",
+        type=int,
+        default=None,
+    )
+    budget_options.add_argument(
+        "--max-time",
+        help="Maximum run time in seconds (no limit by default)",
+        type=float,
+        default=None,
+    )
+    budget_options.add_argument(
+        "--topic-priority",
+        help="Order of the topics: by their weight in the slides, by "
+        "their coherence, or in the order of the LDA model",
+        choices=TOPIC_PRIORITIES,
+        default="weight",
+    )
 
     # multi choice question options
     multi_choice_options = parser.add_argument_group(
         "Multiple choice question options"
     )
-    # TODO: add option to generate a fixed number of questions for each topic
-    # multi_choice_options.add_argument(
-    #     "--max-questions",
-    #     "-q",
-    #     help="Maximum number of questions to generate for each topic",
-    #     type=int,
-    #     default=5,
-    # )
+    multi_choice_options.add_argument(
+        "--max-questions",
+        "-q",
+        help="Maximum number of questions to generate for each topic "
+        "(no limit by default)",
+        type=int,
+        default=None,
+    )
+
+    multi_choice_options.add_argument(
+        "--duplicate-threshold",
+        help="Similarity (between 0 and 1) above which two questions are "
+        "near-duplicates, only one question of each group of "
+        "near-duplicates is kept",
+        type=float,
+        default=0.6,
+    )
+    multi_choice_options.add_argument(
+        "--keep-duplicates",
+        action="store_true",
+        help="Keep the near-duplicate questions",
+    )
 
     multi_choice_options.add_argument(
         "--max-answers",
@@ -126,7 +282,7 @@ def get_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
         "--llm-model",
         help="LLM model to use for generating questions and answers",
         type=str,
-        default="gemini-1.5-flash-latest",
+        default=DEFAULT_LLM_MODEL,
     )
     llm_options.add_argument(
         "--max-retries",
@@ -134,6 +290,96 @@ def get_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
         type=int,
         default=6,
     )
+    llm_options.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the generated questions and generate the answers to "
+        "each question as soon as it is complete",
+    )
+
+    llm_options.add_argument(
+        "--batch-tokens",
+        help="Send the questions of a topic together to generate their "
+        "multiple choice answers and choose their correct answers, in "
+        "batches of at most this many (estimated) prompt and output "
+        "tokens; the questions whose response can't be parsed are sent "
+        "again on their own (one question per LLM call by default)",
+        type=int,
+        default=None,
+    )
+
+    resilience_options = parser.add_argument_group(
+        "Resilience options",
+        "Deadlines, hedged requests and circuit breaking for the LLM and "
+        "embedding requests",
+    )
+    resilience_options.add_argument(
+        "--request-timeout",
+        help="Seconds after which an LLM or embedding request is abandoned",
+        type=float,
+        default=120.0,
+    )
+    resilience_options.add_argument(
+        "--hedge-percentile",
+        help="Send a duplicate request when a request takes longer than "
+        "this percentile (between 0 and 1) of the recent latencies of its "
+        "stage, and use the first response (duplicate requests count "
+        "against the budget)",
+        type=float,
+        default=0.95,
+    )
+    resilience_options.add_argument(
+        "--no-hedging",
+        action="store_true",
+        help="Never send duplicate requests",
+    )
+    resilience_options.add_argument(
+        "--circuit-failures",
+        help="Number of consecutive failed requests after which the "
+        "requests fail fast until the backend recovers",
+        type=int,
+        default=5,
+    )
+    resilience_options.add_argument(
+        "--circuit-reset-time",
+        help="Seconds to wait before trying a failing backend again "
+        "(doubled after each failed attempt)",
+        type=float,
+        default=30.0,
+    )
+
+    stage_options = parser.add_argument_group(
+        "Per-stage LLM options",
+        "Override the LLM options for a single stage of the generation "
+        "(for example, to send the cheap stages to a faster model)",
+    )
+    for stage in STAGES:
+        description = STAGE_DESCRIPTIONS[stage]
+        stage_options.add_argument(
+            f"--{stage}-model",
+            help=f"LLM model used for {description} (--llm-model by default)",
+            type=str,
+            default=None,
+        )
+        stage_options.add_argument(
+            f"--{stage}-temperature",
+            help=f"Sampling temperature when {description}",
+            type=float,
+            default=None,
+        )
+        stage_options.add_argument(
+            f"--{stage}-max-output-tokens",
+            help=f"Maximum number of output tokens when {description}",
+            type=int,
+            default=DEFAULT_STAGE_MAX_OUTPUT_TOKENS.get(stage),
+        )
+        stage_options.add_argument(
+            f"--{stage}-max-retries",
+            help=f"Maximum number of retries when {description} "
+            "(--max-retries by default)",
+            type=int,
+            default=None,
+        )
 
     args = parser.parse_args(argv)
 
@@ -149,6 +395,15 @@ def get_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
             "and minimum number of answers must be at least 1"
         )
 
+    if args.max_questions is not None and args.max_questions < 1:
+        parser.error("Maximum number of questions must be at least 1")
+
+    if not 0 < args.duplicate_threshold <= 1:
+        parser.error("Duplicate threshold must be between 0 and 1")
+
+    if not 0 < args.duplicate_page_threshold <= 1:
+        parser.error("Duplicate page threshold must be between 0 and 1")
+
     if args.correct_answers > args.min_answers:
         parser.error(
             "Number of correct answers must be less than "
@@ -161,12 +416,291 @@ def get_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
             "or equal to the maximum number of answers"
         )
 
+    if args.max_llm_calls is not None and args.max_llm_calls < 1:
+        parser.error("Maximum number of LLM calls must be at least 1")
+
+    if args.max_tokens is not None and args.max_tokens < 1:
+        parser.error("Maximum number of tokens must be at least 1")
+
+    if args.max_time is not None and args.max_time <= 0:
+        parser.error("Maximum run time must be positive")
+
+    if args.batch_tokens is not None and args.batch_tokens < 1:
+        parser.error("Maximum number of tokens of a batch must be at least 1")
+
+    if args.watch_interval <= 0:
+        parser.error("Watch interval must be positive")
+
+    if args.request_timeout <= 0:
+        parser.error("Request timeout must be positive")
+
+    if not 0 < args.hedge_percentile < 1:
+        parser.error("Hedge percentile must be between 0 and 1")
+
+    if args.circuit_failures < 1:
+        parser.error("Number of circuit failures must be at least 1")
+
+    if args.circuit_reset_time <= 0:
+        parser.error("Circuit reset time must be positive")
+
+    if args.ocr_workers is not None and args.ocr_workers < 1:
+        parser.error("Number of OCR workers must be at least 1")
+
     if os.path.isdir(args.pdf_directory) is False:
         parser.error("The specified PDF directory does not exist")
 
     return args
 
 
+def get_stage_option(args: argparse.Namespace, stage: str, option: str):
+    return getattr(args, f"{stage}_{option}".replace("-", "_"))
+
+
+def generate_question_bank(
+    args: argparse.Namespace,
+    guessed_topics: List[str],
+    topic_order: List[int],
+    retrieval_qa_chains: Dict[str, Any],
+    *,
+    topic_indices: Optional[List[Optional[int]]] = None,
+    kept_questions: Sequence[Dict[str, Any]] = (),
+    resume: bool = False,
+) -> None:
+    """
+    Generate the questions of the topics and export them with the kept ones.
+
+    Args
+    ----
+    args (argparse.Namespace): Command line arguments.
+    guessed_topics (List[str]): Name of each topic.
+    topic_order (List[int]): Indices of the topics to generate, in order.
+    retrieval_qa_chains (Dict[str, Any]): Retrieval QA chain of each stage.
+    topic_indices (Optional[List[Optional[int]]]): LDA topic index of each\
+        topic, to restrict the retrieval to the pages of the topic.
+    kept_questions (Sequence[Dict[str, Any]]): Exported questions to keep\
+        in the output file.
+    resume (bool): Whether to recover the questions exported by an\
+        interrupted run.
+
+    Raises
+    ------
+    BudgetExhausted
+        If the budget ran out, after exporting the questions generated so
+        far.
+    """
+    duplicate_index = (
+        None
+        if args.keep_duplicates
+        else MinHashLSH(threshold=args.duplicate_threshold)
+    )
+
+    # save each question to a file as soon as its correct answers are
+    # chosen, so that the questions generated before the budget runs out are
+    # kept
+    partial_file_path = get_partial_file_path(args.output)
+    if not resume and os.path.exists(partial_file_path):
+        print(
+            "Discarding the questions exported by an interrupted run to "
+            f"{partial_file_path} (use --resume to recover them)"
+        )
+    with QuestionExporter(
+        args.output, output_format=args.output_format, resume=resume
+    ) as exporter:
+        # the questions recovered from an interrupted run are already exported
+        recovered_questions = {
+            record["question"] for record in exporter.recovered_questions
+        }
+        if recovered_questions:
+            print(
+                f"Recovered {len(recovered_questions)} questions from "
+                f"{exporter.partial_file_path}"
+            )
+        if duplicate_index is not None:
+            for record in exporter.recovered_questions:
+                duplicate_index.add(record["question"])
+
+        for record in kept_questions:
+            if record["question"] in recovered_questions:
+                continue
+            exporter.add(
+                record["topic"],
+                record["question"],
+                record["answers"],
+                record["correct_answer"],
+            )
+            if duplicate_index is not None:
+                duplicate_index.add(record["question"])
+
+        try:
+            generate_topics_by_priority(
+                guessed_topics,
+                topic_order,
+                retrieval_qa_chains,
+                exporter,
+                stream=args.stream,
+                max_questions=args.max_questions,
+                duplicate_index=duplicate_index,
+                min_number_of_answers=args.min_answers,
+                max_number_of_answers=args.max_answers,
+                number_of_correct_answers=args.correct_answers,
+                batch_tokens=args.batch_tokens,
+                topic_indices=topic_indices,
+                verbose=args.verbose,
+            )
+        except BudgetExhausted:
+            # the questions generated so far are exported
+            exporter.close()
+            raise
+
+
+def update_question_bank(
+    args: argparse.Namespace,
+    question_bank: QuestionBank,
+    guessed_topics: List[str],
+    retrieval_qa_chains: Dict[str, Any],
+    changes: FileChanges,
+) -> QuestionBank:
+    """
+    Process the changed PDF files and generate the questions of the topics
+    whose pages changed again.
+
+    The question bank is not modified, so if the update fails it can be
+    applied again to the same question bank.
+
+    Args
+    ----
+    args (argparse.Namespace): Command line arguments.
+    question_bank (QuestionBank): Pages, topics and vector store.
+    guessed_topics (List[str]): Name of each topic.
+    retrieval_qa_chains (Dict[str, Any]): Retrieval QA chain of each stage.
+    changes (FileChanges): Changed files.
+
+    Returns
+    -------
+    QuestionBank
+        Updated question bank.
+    """
+    docs = load_pdf_files(
+        changes.added + changes.modified,
+        extract_text_from_images=args.extract_text_from_images,
+        min_image_area=args.min_image_area,
+        max_workers=args.ocr_workers,
+        ocr_cache_directory=args.ocr_cache_directory,
+        verbose=args.verbose,
+    )
+    if docs and not args.keep_boilerplate:
+        docs = remove_boilerplate(
+            docs,
+            duplicate_page_threshold=args.duplicate_page_threshold,
+            verbose=args.verbose,
+        )
+
+    # the topics are not extracted again, the new pages are assigned to them
+    page_contents = translate_non_english_page_contents(
+        [doc.page_content for doc in docs], verbose=args.verbose
+    )
+    document_topics = infer_document_topics(
+        question_bank.lda_topics, page_contents
+    )
+    question_bank, changed_topics = question_bank.apply_changes(
+        changes, docs, document_topics
+    )
+    if not changed_topics:
+        return question_bank
+
+    topics_with_pages = question_bank.get_topics_with_pages()
+    topic_order = [
+        topic_index
+        for topic_index in rank_topics(
+            question_bank.lda_topics, by=args.topic_priority
+        )
+        if topic_index in changed_topics and topic_index in topics_with_pages
+    ]
+    # the questions of the changed topics are replaced (or removed, for the
+    # topics without pages left)
+    replaced_topics = {guessed_topics[i].strip() for i in changed_topics}
+    kept_questions = [
+        record
+        for record in load_exported_questions(args.output, args.output_format)
+        if record["topic"] not in replaced_topics
+    ]
+    print(
+        f"Generating the questions of {len(topic_order)} changed topics "
+        f"again, keeping {len(kept_questions)} questions"
+    )
+
+    generate_question_bank(
+        args,
+        guessed_topics,
+        topic_order,
+        retrieval_qa_chains,
+        topic_indices=(
+            None if args.no_topic_filter else question_bank.get_topic_indices()
+        ),
+        kept_questions=kept_questions,
+    )
+    return question_bank
+
+
+def watch_question_bank(
+    args: argparse.Namespace,
+    question_bank: QuestionBank,
+    guessed_topics: List[str],
+    retrieval_qa_chains: Dict[str, Any],
+    snapshot: Dict[str, FileState],
+) -> None:
+    """
+    Update the question bank whenever the PDF files change, until
+    interrupted.
+
+    Args
+    ----
+    args (argparse.Namespace): Command line arguments.
+    question_bank (QuestionBank): Pages, topics and vector store.
+    guessed_topics (List[str]): Name of each topic.
+    retrieval_qa_chains (Dict[str, Any]): Retrieval QA chain of each stage.
+    snapshot (Dict[str, FileState]): Snapshot of the processed PDF files.
+    """
+    print(f"Watching {args.pdf_directory} for changes (Ctrl+C to stop)")
+    try:
+        while True:
+            changes, new_snapshot = wait_for_file_changes(
+                args.pdf_directory, snapshot, interval=args.watch_interval
+            )
+            print(
+                f"Added {len(changes.added)}, modified "
+                f"{len(changes.modified)} and removed "
+                f"{len(changes.removed)} PDF files"
+            )
+            # each update has the budget of a run
+            budget = Budget(
+                max_calls=args.max_llm_calls,
+                max_tokens=args.max_tokens,
+                max_seconds=args.max_time,
+            )
+            # the snapshot and the question bank are only replaced once the
+            # update succeeded, otherwise the same changes are processed
+            # again at the next poll
+            with activate_budget(budget):
+                try:
+                    question_bank = update_question_bank(
+                        args,
+                        question_bank,
+                        guessed_topics,
+                        retrieval_qa_chains,
+                        changes,
+                    )
+                    snapshot = new_snapshot
+                except (BudgetExhausted, BackendUnavailable) as error:
+                    print(f"Stopped updating the questions: {error}")
+                except Exception as error:
+                    print(f"Failed to update the questions: {error!r}")
+            if args.verbose:
+                print(f"Used {budget.summary()}")
+    except KeyboardInterrupt:
+        print("Stopped watching")
+
+
 def main(argv: Optional[Sequence[str]] = None) -> int:
     # this prevents OpenMP from crashing
     os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
@@ -174,13 +708,38 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
 
     args = get_args(argv)
 
+    for backend in (LLM_CALLS, EMBEDDING_CALLS):
+        configure_backend(
+            backend,
+            timeout=args.request_timeout,
+            hedge_percentile=(
+                None if args.no_hedging else args.hedge_percentile
+            ),
+            circuit_breaker=CircuitBreaker(
+                failure_threshold=args.circuit_failures,
+                reset_timeout=args.circuit_reset_time,
+            ),
+        )
+
+    # the run time is counted from the start, including the PDF loading
+    budget = Budget(
+        max_calls=args.max_llm_calls,
+        max_tokens=args.max_tokens,
+        max_seconds=args.max_time,
+    )
+
+    # in watch mode, the files changed from now on are processed again
+    snapshot = snapshot_pdf_files(args.pdf_directory) if args.watch else {}
+
     # extract text from PDF
-    pdf_loader = PyPDFDirectoryLoader(
+    docs = load_pdfs(
         args.pdf_directory,
-        glob="*.pdf",
-        extract_images=args.extract_text_from_images,
+        extract_text_from_images=args.extract_text_from_images,
+        min_image_area=args.min_image_area,
+        max_workers=args.ocr_workers,
+        ocr_cache_directory=args.ocr_cache_directory,
+        verbose=args.verbose,
     )
-    docs = pdf_loader.load()
 
     if not docs:
         print("No PDF files found")
@@ -190,52 +749,109 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
         # print information about the PDF
         print(f"Number of pages: {len(docs)}")
 
-    guessed_topics = extract_and_translate_topics(
-        docs,
-        number_of_topics=args.number_of_topics,
-        passes_over_corpus=args.passes_over_corpus,
-        verbose=args.verbose,
-    )
-
-    # save text to a dataset
-    retrieval_qa_chain = get_retrieval_qa_chain(
-        docs, llm_model_name=args.llm_model, max_retries=args.max_retries
+    model_configs = get_stage_model_configs(
+        default_model=args.llm_model,
+        default_max_retries=args.max_retries,
+        models={
+            stage: get_stage_option(args, stage, "model") for stage in STAGES
+        },
+        temperatures={
+            stage: get_stage_option(args, stage, "temperature")
+            for stage in STAGES
+        },
+        max_output_tokens={
+            stage: get_stage_option(args, stage, "max_output_tokens")
+            for stage in STAGES
+        },
+        max_retries={
+            stage: get_stage_option(args, stage, "max_retries")
+            for stage in STAGES
+        },
     )
 
-    questions = generate_questions(
-        guessed_topics,
-        retrieval_qa_chain,
-        verbose=args.verbose,
-    )
+    if not args.keep_boilerplate:
+        docs = remove_boilerplate(
+            docs,
+            duplicate_page_threshold=args.duplicate_page_threshold,
+            verbose=args.verbose,
+        )
 
-    # generate the answers to the questions
-    answers = generate_multi_choice_answers(
-        guessed_topics,
-        questions,
-        retrieval_qa_chain,
-        min_number_of_answers=args.min_answers,
-        max_number_of_answers=args.max_answers,
-        number_of_correct_answers=args.correct_answers,
-        verbose=args.verbose,
-    )
+    with activate_budget(budget):
+        try:
+            guessed_topics, lda_topics = extract_and_translate_topics(
+                docs,
+                number_of_topics=args.number_of_topics,
+                passes_over_corpus=args.passes_over_corpus,
+                model_config=model_configs[TOPICS],
+                topic_labels=args.topic_labels,
+                verbose=args.verbose,
+            )
+        except (BudgetExhausted, BackendUnavailable) as error:
+            print(f"Stopped before generating any question: {error}")
+            return 1
+
+        topic_indices: Optional[List[Optional[int]]] = None
+        if not args.no_topic_filter:
+            # restrict the retrieval for each topic to the pages of the
+            # topic, except for the topics without pages
+            docs = assign_topics_to_documents(
+                docs, lda_topics.document_topics
+            )
+            topics_with_pages = {
+                topic_index
+                for topics in lda_topics.document_topics
+                for topic_index, _ in topics
+            }
+            topic_indices = [
+                topic_index if topic_index in topics_with_pages else None
+                for topic_index in range(len(guessed_topics))
+            ]
+
+        # save text to a dataset
+        try:
+            vector_store = get_vector_store(docs)
+        except (BudgetExhausted, BackendUnavailable) as error:
+            print(f"Stopped before generating any question: {error}")
+            return 1
+        retrieval_qa_chains = get_stage_retrieval_qa_chains(
+            vector_store,
+            {
+                stage: model_config
+                for stage, model_config in model_configs.items()
+                if stage != TOPICS
+            },
+        )
 
-    correct_answers = generate_correct_answers(
-        guessed_topics,
-        questions,
-        answers,
-        args.correct_answers,
-        retrieval_qa_chain,
-        verbose=args.verbose,
-    )
+        try:
+            generate_question_bank(
+                args,
+                guessed_topics,
+                rank_topics(lda_topics, by=args.topic_priority),
+                retrieval_qa_chains,
+                topic_indices=topic_indices,
+                resume=args.resume,
+            )
+        except BudgetExhausted as error:
+            print(f"Stopped early, {error}")
 
-    # save the questions and answers to a file
-    export_questions_and_answers(
-        guessed_topics,
-        questions,
-        answers,
-        correct_answers,
-        file_path=args.output,
-    )
+    if args.verbose:
+        print(f"Used {budget.summary()}")
+
+    if args.watch:
+        question_bank = QuestionBank(
+            docs,
+            lda_topics.document_topics,
+            lda_topics,
+            vector_store,
+            topic_filter=not args.no_topic_filter,
+        )
+        watch_question_bank(
+            args,
+            question_bank,
+            guessed_topics,
+            retrieval_qa_chains,
+            snapshot,
+        )
 
     return 0
 
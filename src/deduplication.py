@@ -0,0 +1,292 @@
+"""
+Near-duplicate detection with MinHash signatures and locality sensitive
+hashing (LSH).
+
+Texts are compared through their character shingles. Only texts sharing an
+LSH bucket are compared with each other, so finding the near-duplicates of
+`n` texts does not take `n * n` comparisons.
+"""
+
+import re
+import zlib
+from collections import defaultdict
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_NON_WORD = re.compile(r"\W+")
+
+
+def get_shingles(text: str, *, size: int = 4) -> FrozenSet[int]:
+    """
+    Get the hashed character shingles of a text.
+
+    Args
+    ----
+    text (str): Text.
+    size (int): Number of characters in a shingle.
+
+    Returns
+    -------
+    FrozenSet[int]
+        Hashes of the shingles of the lowercase text with punctuation and
+        whitespace collapsed into single spaces.
+    """
+    normalized = _NON_WORD.sub(" ", text.lower()).strip()
+    if len(normalized) <= size:
+        return frozenset([zlib.crc32(normalized.encode())])
+    return frozenset(
+        zlib.crc32(normalized[i: i + size].encode())
+        for i in range(len(normalized) - size + 1)
+    )
+
+
+def jaccard_similarity(first: FrozenSet[int], second: FrozenSet[int]) -> float:
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+def _get_bands_and_rows(
+    number_of_permutations: int, threshold: float
+) -> Tuple[int, int]:
+    # the similarity at which two texts become likely to share a bucket is
+    # about (1 / bands) ** (1 / rows), pick the closest to the threshold
+    return min(
+        (
+            (bands, number_of_permutations // bands)
+            for bands in range(1, number_of_permutations + 1)
+            if number_of_permutations % bands == 0
+        ),
+        key=lambda band_and_rows: abs(
+            (1 / band_and_rows[0]) ** (1 / band_and_rows[1]) - threshold
+        ),
+    )
+
+
+class MinHashLSH:
+    """
+    Index of texts for finding near-duplicates.
+
+    Args
+    ----
+    threshold (float): Jaccard similarity of the shingles above which two\
+        texts are near-duplicates.
+    number_of_permutations (int): Number of hash functions in a MinHash\
+        signature. More permutations find more of the near-duplicates, but\
+        are slower.
+    seed (int): Seed of the hash functions.
+    """
+
+    def __init__(
+        self,
+        *,
+        threshold: float = 0.6,
+        number_of_permutations: int = 64,
+        seed: int = 0,
+    ) -> None:
+        self.threshold = threshold
+        self.bands, self.rows = _get_bands_and_rows(
+            number_of_permutations, threshold
+        )
+        generator = np.random.default_rng(seed)
+        shape = (number_of_permutations, 1)
+        self._a = generator.integers(
+            1, _MERSENNE_PRIME, size=shape, dtype=np.uint64
+        )
+        self._b = generator.integers(
+            0, _MERSENNE_PRIME, size=shape, dtype=np.uint64
+        )
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = (
+            defaultdict(list)
+        )
+        self._shingles: List[FrozenSet[int]] = []
+
+    def __len__(self) -> int:
+        return len(self._shingles)
+
+    def _signature(self, shingles: FrozenSet[int]) -> List[int]:
+        hashes = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+        # the products overflow, which is fine for hashing
+        permuted = (self._a * hashes + self._b) % np.uint64(_MERSENNE_PRIME)
+        return (permuted & np.uint64(_MAX_HASH)).min(axis=1).tolist()
+
+    def _band_keys(
+        self, shingles: FrozenSet[int]
+    ) -> List[Tuple[int, Tuple[int, ...]]]:
+        signature = self._signature(shingles)
+        return [
+            (band, tuple(signature[band * self.rows: (band + 1) * self.rows]))
+            for band in range(self.bands)
+        ]
+
+    def _find(
+        self,
+        shingles: FrozenSet[int],
+        band_keys: List[Tuple[int, Tuple[int, ...]]],
+    ) -> List[int]:
+        candidates = {
+            index for key in band_keys for index in self._buckets.get(key, [])
+        }
+        return sorted(
+            index
+            for index in candidates
+            if jaccard_similarity(shingles, self._shingles[index])
+            >= self.threshold
+        )
+
+    def add(self, text: str) -> List[int]:
+        """
+        Add a text to the index.
+
+        Args
+        ----
+        text (str): Text.
+
+        Returns
+        -------
+        List[int]
+            Indices (in the order of addition) of the texts already in the
+            index that are near-duplicates of the text.
+        """
+        shingles = get_shingles(text)
+        band_keys = self._band_keys(shingles)
+        duplicates = self._find(shingles, band_keys)
+
+        index = len(self._shingles)
+        self._shingles.append(shingles)
+        for key in band_keys:
+            self._buckets[key].append(index)
+        return duplicates
+
+    def query(self, text: str) -> List[int]:
+        """
+        Find the near-duplicates of a text without adding it to the index.
+
+        Args
+        ----
+        text (str): Text.
+
+        Returns
+        -------
+        List[int]
+            Indices of the texts in the index that are near-duplicates of the
+            text.
+        """
+        shingles = get_shingles(text)
+        return self._find(shingles, self._band_keys(shingles))
+
+
+def find_near_duplicate_clusters(
+    texts: List[str], *, threshold: float = 0.6
+) -> List[List[int]]:
+    """
+    Cluster the texts that are near-duplicates of each other.
+
+    The first text of each cluster leads it, and the following texts join the
+    cluster of the first leader they are a near-duplicate of. Near-duplicates
+    are not chained, so a cluster does not drift away from its leader.
+
+    Args
+    ----
+    texts (List[str]): Texts.
+    threshold (float): Jaccard similarity of the shingles above which two\
+        texts are near-duplicates.
+
+    Returns
+    -------
+    List[List[int]]
+        Sorted indices of the texts in each cluster, in the order of the
+        first text of each cluster. Texts without near-duplicates are in a
+        cluster of their own.
+    """
+    leaders = MinHashLSH(threshold=threshold)
+    clusters: List[List[int]] = []
+    for i, text in enumerate(texts):
+        duplicates = leaders.query(text)
+        if duplicates:
+            clusters[duplicates[0]].append(i)
+        else:
+            leaders.add(text)
+            clusters.append([i])
+    return clusters
+
+
+class DeduplicatedQuestions(NamedTuple):
+    questions: List[List[str]]
+    number_of_removed_questions: int
+
+
+def deduplicate_questions(
+    questions: List[List[str]],
+    *,
+    threshold: float = 0.6,
+    previous_questions: Optional[MinHashLSH] = None,
+) -> DeduplicatedQuestions:
+    """
+    Remove the near-duplicate questions, within and across topics.
+
+    The most specific question of each cluster of near-duplicates (the one
+    with the most distinct shingles, or the first one on ties) is kept in
+    its topic.
+
+    Args
+    ----
+    questions (List[List[str]]): Questions for each topic.
+    threshold (float): Jaccard similarity of the shingles above which two\
+        questions are near-duplicates.
+    previous_questions (Optional[MinHashLSH]): Index of the questions kept\
+        earlier in the run. The questions that are near-duplicates of them\
+        are removed as well, and the kept questions are added to it.
+
+    Returns
+    -------
+    DeduplicatedQuestions
+        Questions for each topic without the near-duplicates, and the number
+        of questions removed.
+    """
+    positions = [
+        (topic_index, question_index)
+        for topic_index, question_list in enumerate(questions)
+        for question_index in range(len(question_list))
+    ]
+    flat_questions = [questions[i][j] for i, j in positions]
+
+    kept = set()
+    for cluster in find_near_duplicate_clusters(
+        flat_questions, threshold=threshold
+    ):
+        kept.add(
+            max(
+                cluster,
+                key=lambda i: (
+                    len(get_shingles(flat_questions[i])),
+                    -i,
+                ),
+            )
+        )
+
+    if previous_questions is not None:
+        kept = {
+            i for i in kept if not previous_questions.query(flat_questions[i])
+        }
+
+    deduplicated: List[List[str]] = [[] for _ in questions]
+    for i, (topic_index, _) in enumerate(positions):
+        if i in kept:
+            deduplicated[topic_index].append(flat_questions[i])
+            if previous_questions is not None:
+                previous_questions.add(flat_questions[i])
+
+    return DeduplicatedQuestions(
+        deduplicated, len(flat_questions) - len(kept)
+    )
+
+
+def print_duplicates_report(number_of_duplicates: int) -> None:
+    # the removed questions are not sent to the answers and correct answers
+    # prompts, but the number of calls saved depends on how the questions
+    # are batched
+    print(f"Removed {number_of_duplicates} near-duplicate questions")
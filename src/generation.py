@@ -1,14 +1,163 @@
+import re
 import time
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from google.api_core.exceptions import ResourceExhausted
 from langchain_core.documents.base import Document
 
-from rag import execute_query, process_llm_response
-from response_processing import extract_answers, extract_questions
-from topic_extraction import extract_topics_in_weighted_phrases
-from utils import (detect_language, get_page_contents,
-                   guess_topic_from_weighted_phrases, translate_page_contents)
+from batching import make_batches, section_instructions, split_sections
+from budget import sleep_within_budget
+from deduplication import (MinHashLSH, deduplicate_questions,
+                           print_duplicates_report)
+from models import ANSWER_KEY, OPTIONS, QUESTIONS, ModelConfig
+from parsing import extract_answers, extract_questions, iter_questions
+from rag import (estimate_context_tokens, execute_query,
+                 get_topic_retrieval_qa_chain, process_llm_response,
+                 stream_query)
+from resilience import LLM_CALLS, BackendUnavailable, get_caller
+from response_processing import QuestionExporter
+from topic_extraction import (LdaTopics, extract_topics,
+                              get_local_topic_labels)
+from utils import (get_page_contents, guess_topic_from_weighted_phrases,
+                   translate_non_english_page_contents)
+
+
+# expected output tokens of a multiple choice answer and of the letters of
+# the correct answers to a question, to size the batches
+_OPTION_OUTPUT_TOKENS = 25
+_ANSWER_KEY_OUTPUT_TOKENS = 10
+
+# what may surround the letters of the correct answers in a reply
+_ANSWER_KEY_SEPARATORS = re.compile(r"(?:\band\b|[\s,;&.*_()\[\]])+")
+
+
+def _get_topic_chain(
+    retrieval_qa_chain,
+    topic_indices: Optional[List[Optional[int]]],
+    i: int,
+):
+    # restrict the retrieval to the pages of the i-th topic, if it is known
+    if topic_indices is None or topic_indices[i] is None:
+        return retrieval_qa_chain
+    return get_topic_retrieval_qa_chain(retrieval_qa_chain, topic_indices[i])
+
+
+def _multi_choice_answers_query(
+    topic: str,
+    question: str,
+    *,
+    min_number_of_answers: int,
+    max_number_of_answers: int,
+    number_of_correct_answers: int,
+    negative_response: str,
+) -> str:
+    return (
+        "Your task is to generate multiple choice answers for "
+        f"the following question about {topic!r}. "
+        "The multiple choice answers should be relevant to the "
+        f"question, but only **{number_of_correct_answers}** should "
+        f"be correct. If you can't generate any answers reply with "
+        f"{negative_response!r}. Make sure to provide **only "
+        f"{number_of_correct_answers} correct answers**. Do not "
+        f"include the question itself. Make sure to provide at least "
+        f"{min_number_of_answers} and at most "
+        f"**{max_number_of_answers}** answers. "
+        # "If the question is too general, "
+        # "try to provide answers that are specific. "
+        # "If the question is too specific, "
+        # "try to provide answers that are general. "
+        "Make sure the answers start with a capital letter "
+        "(for example, 'A) Answer', 'B) Answer', etc.). "
+        "Try to provide answers that are not "
+        "too similar to each other. "
+        "The generated answers should not be too long or verbose. "
+        f"Question: {question}"
+    )
+
+
+def generate_multi_choice_answer(
+    topic: str,
+    question: str,
+    retrieval_query_chain,
+    *,
+    min_number_of_answers: int = 4,
+    max_number_of_answers: int = 5,
+    number_of_correct_answers: int = 1,
+    verbose: bool = False,
+) -> List[str]:
+    """
+    Generate the multiple choice answers to a single question.
+
+    Args
+    ----
+    topic (str): Topic of the question.
+    question (str): Question.
+    retrieval_query_chain: Retrieval QA chain used to generate the answers.
+    min_number_of_answers (int): Minimum number of answers.
+    max_number_of_answers (int): Maximum number of answers.
+    number_of_correct_answers (int): Number of correct answers.
+    verbose (bool): Whether to print the response and the answers.
+
+    Returns
+    -------
+    List[str]
+        Multiple choice answers, empty if none were generated.
+    """
+    negative_response = (
+        "I can't"  # this is the response given when no answers are generated
+    )
+    query = _multi_choice_answers_query(
+        topic,
+        question,
+        min_number_of_answers=min_number_of_answers,
+        max_number_of_answers=max_number_of_answers,
+        number_of_correct_answers=number_of_correct_answers,
+        negative_response=negative_response,
+    )
+    response = execute_query(retrieval_query_chain, query, stage=OPTIONS)
+    answer = extract_answers(
+        response["result"],
+        negative_response=negative_response,
+        max_number_of_answers=max_number_of_answers,
+    )
+    if verbose:
+        print(f"Question: {question}")
+        print(f"Response: {response['result']}")
+        print(f"Multiple choice answers: {answer}")
+    return answer
+
+
+def _batched_multi_choice_answers_query(
+    topic: str,
+    questions: List[str],
+    *,
+    min_number_of_answers: int,
+    max_number_of_answers: int,
+    number_of_correct_answers: int,
+    negative_response: str,
+) -> str:
+    numbered_questions = "\n".join(
+        f"{k}. {question}" for k, question in enumerate(questions, start=1)
+    )
+    return (
+        "Your task is to generate multiple choice answers for each of "
+        f"the following questions about {topic!r}. "
+        "The multiple choice answers to a question should be relevant to "
+        f"the question, but only **{number_of_correct_answers}** should "
+        "be correct. If you can't generate any answers to a question reply "
+        f"with {negative_response!r} in its section. Make sure to provide "
+        f"**only {number_of_correct_answers} correct answers** to each "
+        "question. Do not include the questions themselves. Make sure to "
+        f"provide at least {min_number_of_answers} and at most "
+        f"**{max_number_of_answers}** answers to each question. "
+        "Make sure the answers start with a capital letter "
+        "(for example, 'A) Answer', 'B) Answer', etc.). "
+        "Try to provide answers that are not "
+        "too similar to each other. "
+        "The generated answers should not be too long or verbose. "
+        f"{section_instructions(len(questions))}\n"
+        f"Questions:\n{numbered_questions}"
+    )
 
 
 def generate_multi_choice_answers(
@@ -19,15 +168,42 @@ def generate_multi_choice_answers(
     min_number_of_answers: int = 4,
     max_number_of_answers: int = 5,
     number_of_correct_answers: int = 1,
+    batch_tokens: Optional[int] = None,
+    topic_indices: Optional[List[Optional[int]]] = None,
     verbose: bool = False,
     sleep_time: int = 1,
 ) -> List[List[List[str]]]:
+    """
+    Generate the multiple choice answers to the questions of each topic.
+
+    Args
+    ----
+    guessed_topics (List[str]): Topics.
+    questions (List[List[str]]): Questions for each topic.
+    retrieval_query_chain: Retrieval QA chain used to generate the answers.
+    min_number_of_answers (int): Minimum number of answers per question.
+    max_number_of_answers (int): Maximum number of answers per question.
+    number_of_correct_answers (int): Number of correct answers per question.
+    batch_tokens (Optional[int]): If given, the questions of a topic are\
+        sent together in batches of at most this many (estimated) prompt\
+        and output tokens, and the questions whose answers can't be parsed\
+        from the response of their batch are sent again on their own. If\
+        None, each question is sent on its own.
+    topic_indices (Optional[List[Optional[int]]]): LDA topic index of each\
+        topic, to restrict the retrieval to the pages of the topic.
+    verbose (bool): Whether to print the responses and the answers.
+    sleep_time (int): Seconds to wait after each LLM call.
+
+    Returns
+    -------
+    List[List[List[str]]]
+        Multiple choice answers to each question of each topic, empty for
+        the questions without answers.
+    """
+    negative_response = "I can't"
     answers: List[List[List[str]]] = []
 
-    negative_response = (
-        "I can't"  # this is the response given when no answers are generated
-    )
-    for topic, question_list in zip(guessed_topics, questions):
+    for i, (topic, question_list) in enumerate(zip(guessed_topics, questions)):
         if not question_list:
             # no questions were generated for this topic
             answers.append([])
@@ -35,51 +211,90 @@ def generate_multi_choice_answers(
 
         answer_list: List[List[str]] = []
         answers.append(answer_list)
+        topic_chain = _get_topic_chain(retrieval_query_chain, topic_indices, i)
 
-        for j, question in enumerate(question_list):
-            query = (
-                "Your task is to generate multiple choice answers for "
-                f"the following question about {topic!r}. "
-                "The multiple choice answers should be relevant to the "
-                f"question, but only **{number_of_correct_answers}** should "
-                f"be correct. If you can't generate any answers reply with "
-                f"{negative_response!r}. Make sure to provide **only "
-                f"{number_of_correct_answers} correct answers**. Do not "
-                f"include the question itself. Make sure to provide at least "
-                f"{min_number_of_answers} and at most "
-                f"**{max_number_of_answers}** answers. "
-                # "If the question is too general, "
-                # "try to provide answers that are specific. "
-                # "If the question is too specific, "
-                # "try to provide answers that are general. "
-                "Make sure the answers start with a capital letter "
-                "(for example, 'A) Answer', 'B) Answer', etc.). "
-                "Try to provide answers that are not "
-                "too similar to each other. "
-                "The generated answers should not be too long or verbose. "
-                f"Question: {question}"
-            )
-            response = execute_query(retrieval_query_chain, query)
-            answer = extract_answers(
-                response["result"],
-                negative_response=negative_response,
+        def build_prompt(batch: List[str]) -> str:
+            return _batched_multi_choice_answers_query(
+                topic,
+                batch,
+                min_number_of_answers=min_number_of_answers,
                 max_number_of_answers=max_number_of_answers,
+                number_of_correct_answers=number_of_correct_answers,
+                negative_response=negative_response,
             )
-            if verbose:
-                print(f"Question {j + 1}: {question}")
-                print(f"Response: {response['result']}")
-                print(f"Multiple choice answers: {answer}")
-            answer_list.append(answer)
 
-            time.sleep(sleep_time)
+        batches = (
+            [[question] for question in question_list]
+            if batch_tokens is None
+            else make_batches(
+                question_list,
+                build_prompt=build_prompt,
+                output_tokens_per_item=(
+                    max_number_of_answers * _OPTION_OUTPUT_TOKENS
+                ),
+                max_tokens=batch_tokens,
+                context_tokens=estimate_context_tokens(topic_chain),
+            )
+        )
+
+        for batch in batches:
+            replies: List[Optional[str]] = [None] * len(batch)
+            if len(batch) > 1:
+                response = execute_query(
+                    topic_chain, build_prompt(batch), stage=OPTIONS
+                )
+                replies = split_sections(response["result"], len(batch))
+                time.sleep(sleep_time)
+
+            for question, reply in zip(batch, replies):
+                answer = (
+                    []
+                    if reply is None
+                    else extract_answers(
+                        reply,
+                        negative_response=negative_response,
+                        max_number_of_answers=max_number_of_answers,
+                    )
+                )
+                if reply is None or (
+                    not answer
+                    and negative_response.lower() not in reply.lower()
+                ):
+                    # not answered (or not parsed) in the batch
+                    answer = generate_multi_choice_answer(
+                        topic,
+                        question,
+                        topic_chain,
+                        min_number_of_answers=min_number_of_answers,
+                        max_number_of_answers=max_number_of_answers,
+                        number_of_correct_answers=number_of_correct_answers,
+                        verbose=verbose,
+                    )
+                    time.sleep(sleep_time)
+                elif verbose:
+                    print(f"Question: {question}")
+                    print(f"Response: {reply}")
+                    print(f"Multiple choice answers: {answer}")
+                answer_list.append(answer)
 
     return answers
 
 
+def _questions_query(guessed_topic: str, negative_response: str) -> str:
+    return (
+        "Generate questions from the provided "
+        "text about the following topic. "
+        "If you can't generate any questions reply "
+        f"with {negative_response!r}. The Topic: {guessed_topic}"
+    )
+
+
 def generate_questions(
     guessed_topics,
     retrieval_qa_chain,
     *,
+    max_questions: Optional[int] = None,
+    topic_indices: Optional[List[Optional[int]]] = None,
     verbose=False,
     sleep_time=1,
 ):
@@ -90,17 +305,16 @@ def generate_questions(
         # generate questions for each topic
         if verbose:
             print(f"Generating questions for topic {i + 1}: {guessed_topic}")
-        query = (
-            "Generate questions from the provided "
-            "text about the following topic. "
-            "If you can't generate any questions reply "
-            f"with {negative_response!r}. The Topic: {guessed_topic}"
-        )
+        query = _questions_query(guessed_topic, negative_response)
         try:
-            response = execute_query(retrieval_qa_chain, query)
+            response = execute_query(
+                _get_topic_chain(retrieval_qa_chain, topic_indices, i),
+                query,
+                stage=QUESTIONS,
+            )
             extracted_questions = extract_questions(
                 response["result"], negative_response
-            )
+            )[:max_questions]
             if verbose:
                 process_llm_response(response)
                 print(f"Extracted questions: {extracted_questions}")
@@ -114,6 +328,238 @@ def generate_questions(
     return questions
 
 
+def generate_questions_and_answers_streaming(
+    guessed_topics: List[str],
+    retrieval_qa_chain,
+    *,
+    options_retrieval_qa_chain=None,
+    max_questions: Optional[int] = None,
+    duplicate_index: Optional[MinHashLSH] = None,
+    min_number_of_answers: int = 4,
+    max_number_of_answers: int = 5,
+    number_of_correct_answers: int = 1,
+    topic_indices: Optional[List[Optional[int]]] = None,
+    verbose: bool = False,
+    sleep_time: int = 1,
+) -> Tuple[List[List[str]], List[List[List[str]]], int]:
+    """
+    Generate questions and their multiple choice answers, streaming the
+    questions.
+
+    Each question is sent to answer generation as soon as it is complete in
+    the streamed response, and the stream is closed once `max_questions`
+    questions were generated for the topic.
+
+    Args
+    ----
+    guessed_topics (List[str]): Topics to generate questions about.
+    retrieval_qa_chain: Retrieval QA chain used to generate the questions.
+    options_retrieval_qa_chain: Retrieval QA chain used to generate the\
+        multiple choice answers. If None, `retrieval_qa_chain` is used.
+    max_questions (Optional[int]): Maximum number of questions per topic.\
+        If None, all the questions in the response are used.
+    duplicate_index (Optional[MinHashLSH]): Index of the questions generated\
+        so far. If given, the questions that are near-duplicates of a\
+        question in the index are skipped, and the other ones are added to it.
+    min_number_of_answers (int): Minimum number of answers.
+    max_number_of_answers (int): Maximum number of answers.
+    number_of_correct_answers (int): Number of correct answers.
+    topic_indices (Optional[List[Optional[int]]]): LDA topic index of each\
+        guessed topic. If given, the retrieval for each topic is restricted\
+        to the pages of its LDA topic (unless its index is None).
+    verbose (bool): Whether to print more information.
+    sleep_time (int): Seconds to wait between LLM calls.
+
+    Returns
+    -------
+    Tuple[List[List[str]], List[List[List[str]]], int]
+        Questions and multiple choice answers, for each topic, and the number
+        of near-duplicate questions skipped.
+    """
+    negative_response = "I can't"
+    if options_retrieval_qa_chain is None:
+        options_retrieval_qa_chain = retrieval_qa_chain
+
+    questions: List[List[str]] = []
+    answers: List[List[List[str]]] = []
+    skipped_duplicates = 0
+    for i, guessed_topic in enumerate(guessed_topics):
+        if verbose:
+            print(f"Generating questions for topic {i + 1}: {guessed_topic}")
+        question_list: List[str] = []
+        answer_list: List[List[str]] = []
+        questions.append(question_list)
+        answers.append(answer_list)
+
+        questions_chain = _get_topic_chain(
+            retrieval_qa_chain, topic_indices, i
+        )
+        options_chain = _get_topic_chain(
+            options_retrieval_qa_chain, topic_indices, i
+        )
+
+        query = _questions_query(guessed_topic, negative_response)
+        token_stream = stream_query(questions_chain, query, stage=QUESTIONS)
+        streamed_questions = iter_questions(token_stream, negative_response)
+        try:
+            for question in streamed_questions:
+                if duplicate_index is not None:
+                    if duplicate_index.query(question):
+                        if verbose:
+                            print(f"Skipping near-duplicate: {question}")
+                        skipped_duplicates += 1
+                        continue
+                    duplicate_index.add(question)
+
+                answer = generate_multi_choice_answer(
+                    guessed_topic,
+                    question,
+                    options_chain,
+                    min_number_of_answers=min_number_of_answers,
+                    max_number_of_answers=max_number_of_answers,
+                    number_of_correct_answers=number_of_correct_answers,
+                    verbose=verbose,
+                )
+                question_list.append(question)
+                answer_list.append(answer)
+
+                if max_questions is not None and (
+                    len(question_list) >= max_questions
+                ):
+                    break
+
+                time.sleep(sleep_time)
+        except ResourceExhausted:
+            print(f"Failed to generate questions for topic {guessed_topic}")
+        finally:
+            # stop receiving the rest of the response
+            streamed_questions.close()
+            token_stream.close()
+
+        time.sleep(sleep_time)
+
+    return questions, answers, skipped_duplicates
+
+
+def _correct_answers_query(
+    topic: str,
+    question: str,
+    answers: List[str],
+    *,
+    number_of_correct_answers: int,
+    negative_response: str,
+) -> str:
+    return (
+        f"Choose the correct answers to the following question "
+        f"about {topic!r}. If you none of the answers are "
+        f"correct reply with {negative_response!r}. Otherwise, "
+        "provide the correct answers chosen from the list of answers. "
+        "Respond with only the letters corresponding to the correct "
+        "answers (for example, 'A, B'; 'A'; 'B' etc.). "
+        f"Make sure to provide **only {number_of_correct_answers} "
+        "correct answers**. Do not include the question nor the full "
+        "answers. \n"
+        f"Question: {question}\n"
+        f"Answers: {answers}\n"
+    )
+
+
+def _batched_correct_answers_query(
+    topic: str,
+    questions_and_answers: List[Tuple[str, List[str]]],
+    *,
+    number_of_correct_answers: int,
+    negative_response: str,
+) -> str:
+    numbered_questions = "\n".join(
+        f"{k}. Question: {question}\nAnswers: {answers}"
+        for k, (question, answers) in enumerate(
+            questions_and_answers, start=1
+        )
+    )
+    return (
+        "Choose the correct answers to each of the following questions "
+        f"about {topic!r}. If none of the answers to a question are "
+        f"correct reply with {negative_response!r} in its section. "
+        "Otherwise, provide the correct answers chosen from the list of "
+        "answers to the question. Respond with only the letters "
+        "corresponding to the correct answers (for example, 'A, B'; 'A'; "
+        f"'B' etc.). Make sure to provide **only {number_of_correct_answers} "
+        "correct answers** to each question. Do not include the questions "
+        "nor the full answers. "
+        f"{section_instructions(len(questions_and_answers))}\n"
+        f"Questions:\n{numbered_questions}"
+    )
+
+
+def _parse_correct_answer(
+    llm_response: str, negative_response: str
+) -> Optional[str]:
+    if negative_response.lower() in llm_response.lower():
+        return None
+    return llm_response
+
+
+def _is_answer_key(
+    reply: str, answers: List[str], negative_response: str
+) -> bool:
+    # a reply is either negative or made only of the letters of the answers
+    if negative_response.lower() in reply.lower():
+        return True
+    letters = [
+        letter for letter in _ANSWER_KEY_SEPARATORS.split(reply) if letter
+    ]
+    answer_letters = {answer.strip()[:1].upper() for answer in answers}
+    return bool(letters) and all(
+        letter.upper() in answer_letters for letter in letters
+    )
+
+
+def generate_correct_answer(
+    topic: str,
+    question: str,
+    answers: List[str],
+    retrieval_qa_chain,
+    *,
+    number_of_correct_answers: int = 1,
+    verbose: bool = False,
+) -> Optional[str]:
+    """
+    Choose the correct answers to a single question.
+
+    Args
+    ----
+    topic (str): Topic of the question.
+    question (str): Question.
+    answers (List[str]): Multiple choice answers to the question.
+    retrieval_qa_chain: Retrieval QA chain used to choose the answers.
+    number_of_correct_answers (int): Number of correct answers.
+    verbose (bool): Whether to print the response and the correct answers.
+
+    Returns
+    -------
+    Optional[str]
+        Letters of the correct answers, or None if none are correct.
+    """
+    negative_response = "I can't"
+    query = _correct_answers_query(
+        topic,
+        question,
+        answers,
+        number_of_correct_answers=number_of_correct_answers,
+        negative_response=negative_response,
+    )
+    response = execute_query(retrieval_qa_chain, query, stage=ANSWER_KEY)
+    correct_answer = _parse_correct_answer(
+        response["result"], negative_response
+    )
+    if verbose:
+        print(f"Question: {question}")
+        print(f"Response: {response['result']}")
+        print(f"Correct answer: {correct_answer}")
+    return correct_answer
+
+
 def generate_correct_answers(
     guessed_topics,
     questions,
@@ -121,6 +567,9 @@ def generate_correct_answers(
     number_of_correct_answers,
     retrieval_qa_chain,
     *,
+    exporter: Optional[QuestionExporter] = None,
+    batch_tokens: Optional[int] = None,
+    topic_indices: Optional[List[Optional[int]]] = None,
     verbose=False,
     sleep_time=1,
 ) -> List[List[Optional[str]]]:
@@ -128,57 +577,247 @@ def generate_correct_answers(
 
     negative_response = "I can't"
 
-    for guessed_topic, question_list, answer_list in zip(
-        guessed_topics, questions, answers
+    for i, (guessed_topic, question_list, answer_list) in enumerate(
+        zip(guessed_topics, questions, answers)
     ):
         if not question_list:
             # no questions were generated for this topic
             correct_answers.append([])
             continue
 
-        correct_answer_list: List[Optional[str]] = []
+        questions_and_answers = list(zip(question_list, answer_list))
+        # the questions without answers have no correct answers
+        correct_answer_list: List[Optional[str]] = [None] * len(
+            questions_and_answers
+        )
         correct_answers.append(correct_answer_list)
+        topic_chain = _get_topic_chain(retrieval_qa_chain, topic_indices, i)
+        answered = [
+            j
+            for j, (_, answers_to_question) in enumerate(questions_and_answers)
+            if answers_to_question
+        ]
+
+        def build_prompt(batch: List[int]) -> str:
+            return _batched_correct_answers_query(
+                guessed_topic,
+                [questions_and_answers[j] for j in batch],
+                number_of_correct_answers=number_of_correct_answers,
+                negative_response=negative_response,
+            )
 
-        for j, (question, answers_to_question) in enumerate(
-            zip(question_list, answer_list)
-        ):
-            if not answers_to_question:
-                # no answers were generated for this question
-                correct_answer_list.append(None)
-                continue
-
-            # generate the correct answers to the question
-            query = (
-                f"Choose the correct answers to the following question "
-                f"about {guessed_topic!r}. If you none of the answers are "
-                f"correct reply with {negative_response!r}. Otherwise, "
-                "provide the correct answers chosen from the list of answers. "
-                "Respond with only the letters corresponding to the correct "
-                "answers (for example, 'A, B'; 'A'; 'B' etc.). "
-                f"Make sure to provide **only {number_of_correct_answers} "
-                "correct answers**. Do not include the question nor the full "
-                "answers. \n"
-                f"Question: {question}\n"
-                f"Answers: {answers_to_question}\n"
+        batches = (
+            [[j] for j in answered]
+            if batch_tokens is None
+            else make_batches(
+                answered,
+                build_prompt=build_prompt,
+                output_tokens_per_item=_ANSWER_KEY_OUTPUT_TOKENS,
+                max_tokens=batch_tokens,
+                context_tokens=estimate_context_tokens(topic_chain),
             )
-            response = execute_query(retrieval_qa_chain, query)
+        )
 
-            # extract the correct answers
-            if negative_response.lower() in response["result"].lower():
-                correct_answer = None
-            else:
-                correct_answer = response["result"]
+        for batch in batches:
+            replies: List[Optional[str]] = [None] * len(batch)
+            if len(batch) > 1:
+                response = execute_query(
+                    topic_chain, build_prompt(batch), stage=ANSWER_KEY
+                )
+                replies = split_sections(response["result"], len(batch))
+                time.sleep(sleep_time)
+
+            for j, reply in zip(batch, replies):
+                question, answers_to_question = questions_and_answers[j]
+                if reply is None or not _is_answer_key(
+                    reply, answers_to_question, negative_response
+                ):
+                    # not answered in the batch, or not with answer letters
+                    correct_answer = generate_correct_answer(
+                        guessed_topic,
+                        question,
+                        answers_to_question,
+                        topic_chain,
+                        number_of_correct_answers=number_of_correct_answers,
+                        verbose=verbose,
+                    )
+                    time.sleep(sleep_time)
+                else:
+                    correct_answer = _parse_correct_answer(
+                        reply, negative_response
+                    )
+                    if verbose:
+                        print(f"Question {j + 1}: {question}")
+                        print(f"Response: {reply}")
+                        print(f"Correct answer: {correct_answer}")
+
+                correct_answer_list[j] = correct_answer
+                if exporter is not None:
+                    exporter.add(
+                        guessed_topic,
+                        question,
+                        answers_to_question,
+                        correct_answer,
+                    )
 
-            if verbose:
-                print(f"Question {j + 1}: {question}")
-                print(f"Response: {response['result']}")
-                print(f"Correct answer: {correct_answer}")
+    return correct_answers
 
-            correct_answer_list.append(correct_answer)
 
-            time.sleep(sleep_time)
+def _wait_for_backend(*, verbose: bool = False) -> None:
+    circuit_breaker = get_caller(LLM_CALLS).circuit_breaker
+    if circuit_breaker is None or not circuit_breaker.retry_after:
+        return
+    if verbose:
+        print(
+            f"Waiting {circuit_breaker.retry_after:.0f} seconds for the LLM "
+            "to recover"
+        )
+    # raises BudgetExhausted if the LLM recovers after the maximum run time
+    sleep_within_budget(circuit_breaker.retry_after)
 
-    return correct_answers
+
+def generate_topics_by_priority(
+    guessed_topics: List[str],
+    topic_order: List[int],
+    retrieval_qa_chains: Dict[str, Any],
+    exporter: QuestionExporter,
+    *,
+    stream: bool = False,
+    max_questions: Optional[int] = None,
+    duplicate_index: Optional[MinHashLSH] = None,
+    min_number_of_answers: int = 4,
+    max_number_of_answers: int = 5,
+    number_of_correct_answers: int = 1,
+    batch_tokens: Optional[int] = None,
+    topic_indices: Optional[List[Optional[int]]] = None,
+    verbose: bool = False,
+) -> int:
+    """
+    Generate the questions, answers and correct answers one topic at a time,
+    in the order of priority.
+
+    Each topic is finished (and its questions exported) before the next one
+    is started, so a run stopped by `BudgetExhausted` keeps the questions of
+    its most important topics. The rest of a topic is skipped when the LLM
+    is unavailable, and the next topic waits for the LLM to recover (or
+    stops with `BudgetExhausted` if it would recover after the maximum run
+    time).
+
+    As the questions of a topic are exported before the next topic is
+    generated, a near-duplicate is removed from the later topic: the
+    question kept is the one of the topic with the highest priority. The
+    number of near-duplicates removed is reported once, at the end.
+
+    Args
+    ----
+    guessed_topics (List[str]): Topics to generate questions about.
+    topic_order (List[int]): Indices of the topics, in the order to\
+        generate them.
+    retrieval_qa_chains (Dict[str, Any]): Retrieval QA chain of the\
+        'question', 'option' and 'answer-key' stages.
+    exporter (QuestionExporter): Exporter receiving each answered question.
+    stream (bool): Whether to stream the questions to answer generation.
+    max_questions (Optional[int]): Maximum number of questions per topic.
+    duplicate_index (Optional[MinHashLSH]): Index of the questions kept so\
+        far. If given, the near-duplicates of earlier questions are skipped.
+    min_number_of_answers (int): Minimum number of answers per question.
+    max_number_of_answers (int): Maximum number of answers per question.
+    number_of_correct_answers (int): Number of correct answers per question.
+    batch_tokens (Optional[int]): If given, maximum number of tokens of a\
+        batch of questions sent together to generate the multiple choice\
+        answers or choose the correct answers (the multiple choice answers\
+        are not batched when streaming).
+    topic_indices (Optional[List[Optional[int]]]): LDA topic index of each\
+        topic, to restrict the retrieval to the pages of the topic.
+    verbose (bool): Whether to print the progress.
+
+    Returns
+    -------
+    int
+        Number of topics finished.
+    """
+    questions_chain = retrieval_qa_chains[QUESTIONS]
+    options_chain = retrieval_qa_chains[OPTIONS]
+    answer_key_chain = retrieval_qa_chains[ANSWER_KEY]
+    number_of_finished_topics = 0
+    number_of_duplicates = 0
+    try:
+        for i in topic_order:
+            topic = [guessed_topics[i]]
+            indices = None if topic_indices is None else [topic_indices[i]]
+            if verbose:
+                print(f"Generating topic {i + 1}: {guessed_topics[i]}")
+
+            # wait for the LLM to recover before starting the topic
+            _wait_for_backend(verbose=verbose)
+            try:
+                if stream:
+                    questions, answers, skipped_duplicates = (
+                        generate_questions_and_answers_streaming(
+                            topic,
+                            questions_chain,
+                            options_retrieval_qa_chain=options_chain,
+                            max_questions=max_questions,
+                            duplicate_index=duplicate_index,
+                            min_number_of_answers=min_number_of_answers,
+                            max_number_of_answers=max_number_of_answers,
+                            number_of_correct_answers=(
+                                number_of_correct_answers
+                            ),
+                            topic_indices=indices,
+                            verbose=verbose,
+                        )
+                    )
+                    number_of_duplicates += skipped_duplicates
+                else:
+                    questions = generate_questions(
+                        topic,
+                        questions_chain,
+                        max_questions=max_questions,
+                        topic_indices=indices,
+                        verbose=verbose,
+                    )
+                    if duplicate_index is not None:
+                        questions, removed_duplicates = deduplicate_questions(
+                            questions,
+                            threshold=duplicate_index.threshold,
+                            previous_questions=duplicate_index,
+                        )
+                        number_of_duplicates += removed_duplicates
+                    answers = generate_multi_choice_answers(
+                        topic,
+                        questions,
+                        options_chain,
+                        min_number_of_answers=min_number_of_answers,
+                        max_number_of_answers=max_number_of_answers,
+                        number_of_correct_answers=number_of_correct_answers,
+                        batch_tokens=batch_tokens,
+                        topic_indices=indices,
+                        verbose=verbose,
+                    )
+
+                generate_correct_answers(
+                    topic,
+                    questions,
+                    answers,
+                    number_of_correct_answers,
+                    answer_key_chain,
+                    exporter=exporter,
+                    batch_tokens=batch_tokens,
+                    topic_indices=indices,
+                    verbose=verbose,
+                )
+            except BackendUnavailable as error:
+                # the questions of the topic answered so far are exported
+                print(f"Skipping the rest of topic {i + 1}: {error}")
+                continue
+            number_of_finished_topics += 1
+    finally:
+        # also reported when the budget runs out
+        if duplicate_index is not None:
+            print_duplicates_report(number_of_duplicates)
+
+    return number_of_finished_topics
 
 
 def extract_and_translate_topics(
@@ -186,33 +825,41 @@ def extract_and_translate_topics(
     *,
     number_of_topics: int = 10,
     passes_over_corpus: int = 5,
+    model_config: ModelConfig = ModelConfig(max_output_tokens=5),
+    topic_labels: str = "llm",
     verbose: bool = False,
     sleep_time: int = 1,
-) -> List[str]:
+) -> Tuple[List[str], LdaTopics]:
     page_contents = [page_content for page_content in get_page_contents(docs)]
 
-    # translate text to English if it is not already in English
-    if (
-        source_language := detect_language("\n".join(page_contents))
-    ) != "english":
-        page_contents = translate_page_contents(page_contents, source_language)
-    elif verbose:
-        print("Text is already in English (no translation needed)")
+    # translate the pages that are not already in English
+    page_contents = translate_non_english_page_contents(
+        page_contents, verbose=verbose
+    )
 
     # extract topics from text
     if verbose:
         print("Extracting topics from text")
-    weighted_phrases = extract_topics_in_weighted_phrases(
+    lda_topics = extract_topics(
         page_contents,
         number_of_topics=number_of_topics,
         passes_over_corpus=passes_over_corpus,
     )
 
+    guessed_topics: List[str]
+    if topic_labels == "local":
+        # name the topics after their top phrases, without calling the LLM
+        guessed_topics = get_local_topic_labels(lda_topics, page_contents)
+        if verbose:
+            for i, guessed_topic in enumerate(guessed_topics):
+                print(f"Label for topic {i + 1}: {guessed_topic}")
+        return guessed_topics, lda_topics
+
     # convert topics to human-readable format
-    guessed_topics: List[str] = []
-    for i, weighted_phrase in enumerate(weighted_phrases):
+    guessed_topics = []
+    for i, weighted_phrase in enumerate(lda_topics.weighted_phrases):
         guessed_topic = guess_topic_from_weighted_phrases(
-            weighted_phrase, guessed_topics
+            weighted_phrase, guessed_topics, model_config
         )
         guessed_topic = guessed_topic.replace("\n", "")
         if verbose:
@@ -224,4 +871,4 @@ def extract_and_translate_topics(
     # TODO: cache topics
     # cache_topics(docs, guessed_topics)
 
-    return guessed_topics
+    return guessed_topics, lda_topics
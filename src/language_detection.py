@@ -0,0 +1,216 @@
+"""
+Offline language identification with character trigrams.
+
+Each language is represented by the trigram frequencies of a short sample of
+its common words and sentences, and a text is assigned to the language under
+which its trigrams are the most likely (naive Bayes with add-one smoothing).
+"""
+
+import functools
+import math
+import re
+from collections import Counter
+from typing import Dict, Optional
+
+_SAMPLES = {
+    "english": (
+        "the of and to in is that for it as was with be by on not this are "
+        "or from at which but have an they you were there been one all we "
+        "their has would when if so no what can more will about other into "
+        "some could them these than then its only also after first used how "
+        "where most between each should such through while because before "
+        "The operating system manages the memory of each process and "
+        "schedules the threads that are ready to run. When a page is not in "
+        "memory, the system loads it from the disk and updates the table. "
+        "This section describes the following important concepts, with an "
+        "example showing how information is stored, transferred and used by "
+        "different applications. Which of these statements is true? What "
+        "are the advantages and the disadvantages of this approach? "
+        "Performance depends on the number of operations and the structure "
+        "of the data, and the communication between the components."
+    ),
+    "turkish": (
+        "bir ve bu da de için ile olarak daha çok gibi olan kadar sonra "
+        "ancak ise değil her şey ama en var yok ne mi olduğu olduğunu "
+        "tarafından arasında üzerinde içinde göre bunun şekilde diğer veya "
+        "yani çünkü böyle şimdi bazı hangi nasıl neden kendi tüm bile "
+        "İşletim sistemi her sürecin belleğini yönetir ve çalışmaya hazır "
+        "olan iş parçacıklarını zamanlar. Bir sayfa bellekte bulunmadığında "
+        "sistem onu diskten yükler ve tabloyu günceller. Bu bölüm aşağıdaki "
+        "önemli kavramları, bilginin farklı uygulamalar tarafından nasıl "
+        "saklandığını, aktarıldığını ve kullanıldığını gösteren bir örnekle "
+        "açıklar. Bu ifadelerden hangisi doğrudur? Bu yaklaşımın avantajları "
+        "ve dezavantajları nelerdir? Performans işlemlerin sayısına ve "
+        "verilerin yapısına, bileşenler arasındaki iletişime bağlıdır."
+    ),
+    "german": (
+        "der die und in den von zu das mit sich des auf für ist im dem "
+        "nicht ein eine als auch es an werden aus er hat dass sie nach wird "
+        "bei einer um am sind noch wie einem über einen so zum war haben "
+        "nur oder aber vor zur bis mehr durch man sein wurde sei welche "
+        "Das Betriebssystem verwaltet den Speicher jedes Prozesses und "
+        "plant die Threads, die zur Ausführung bereit sind. Wenn sich eine "
+        "Seite nicht im Speicher befindet, lädt das System sie von der "
+        "Festplatte und aktualisiert die Tabelle. Dieser Abschnitt "
+        "beschreibt die folgenden wichtigen Konzepte mit einem Beispiel, "
+        "das zeigt, wie Informationen von verschiedenen Anwendungen "
+        "gespeichert, übertragen und verwendet werden. Welche dieser "
+        "Aussagen ist richtig? Was sind die Vorteile und Nachteile dieses "
+        "Ansatzes? Die Leistung hängt von der Anzahl der Operationen und "
+        "der Struktur der Daten sowie der Kommunikation ab."
+    ),
+    "french": (
+        "le de la et les des en un du une que est pour qui dans par plus "
+        "pas au sur ne se ce il sont avec son aux ou mais comme être tout "
+        "nous elle leur bien sans peut cette fait ces entre aussi ses deux "
+        "Le système d'exploitation gère la mémoire de chaque processus et "
+        "planifie les threads qui sont prêts à être exécutés. Lorsqu'une "
+        "page n'est pas en mémoire, le système la charge depuis le disque "
+        "et met à jour la table. Cette section décrit les concepts "
+        "importants suivants, avec un exemple montrant comment les "
+        "informations sont stockées, transférées et utilisées par "
+        "différentes applications. Laquelle de ces affirmations est vraie? "
+        "Quels sont les avantages et les inconvénients de cette approche? "
+        "Les performances dépendent du nombre d'opérations et de la "
+        "structure des données, ainsi que de la communication."
+    ),
+    "spanish": (
+        "de la que el en y a los se del las un por con no una su para es "
+        "al lo como más pero sus le ya o este sí porque esta entre cuando "
+        "muy sin sobre también me hasta hay donde quien desde todo nos "
+        "El sistema operativo gestiona la memoria de cada proceso y "
+        "planifica los hilos que están listos para ejecutarse. Cuando una "
+        "página no está en memoria, el sistema la carga desde el disco y "
+        "actualiza la tabla. Esta sección describe los siguientes "
+        "conceptos importantes, con un ejemplo que muestra cómo la "
+        "información es almacenada, transferida y utilizada por diferentes "
+        "aplicaciones. ¿Cuál de estas afirmaciones es verdadera? ¿Cuáles "
+        "son las ventajas y las desventajas de este enfoque? El rendimiento "
+        "depende del número de operaciones y de la estructura de los "
+        "datos, así como de la comunicación entre los componentes."
+    ),
+    "italian": (
+        "di e il la che in a per un è non una del sono le con si da al "
+        "come della lo ma ha dei nel gli alla più anche questo ci se delle "
+        "o tra quando molto essere stato questa nella quindi perché ogni "
+        "Il sistema operativo gestisce la memoria di ogni processo e "
+        "pianifica i thread che sono pronti per essere eseguiti. Quando una "
+        "pagina non è in memoria, il sistema la carica dal disco e aggiorna "
+        "la tabella. Questa sezione descrive i seguenti concetti "
+        "importanti, con un esempio che mostra come le informazioni vengono "
+        "memorizzate, trasferite e utilizzate da diverse applicazioni. "
+        "Quale di queste affermazioni è vera? Quali sono i vantaggi e gli "
+        "svantaggi di questo approccio? Le prestazioni dipendono dal numero "
+        "di operazioni e dalla struttura dei dati, oltre che dalla "
+        "comunicazione tra i componenti."
+    ),
+    "portuguese": (
+        "de a o que e do da em um para é com não uma os no se na por mais "
+        "as dos como mas foi ao ele das tem à seu sua ou ser quando muito "
+        "há nos já está também só pelo pela até isso então porque após "
+        "O sistema operacional gerencia a memória de cada processo e "
+        "escalona as threads que estão prontas para executar. Quando uma "
+        "página não está na memória, o sistema a carrega do disco e "
+        "atualiza a tabela. Esta seção descreve os seguintes conceitos "
+        "importantes, com um exemplo que mostra como as informações são "
+        "armazenadas, transferidas e utilizadas por diferentes aplicações. "
+        "Qual destas afirmações é verdadeira? Quais são as vantagens e as "
+        "desvantagens desta abordagem? O desempenho depende do número de "
+        "operações e da estrutura dos dados, bem como da comunicação entre "
+        "os componentes."
+    ),
+    "dutch": (
+        "de en van het een in is dat op te zijn met voor niet aan er die "
+        "om ook als bij of door maar naar dan nog wel uit worden wordt "
+        "kan hij zij over tot was heeft deze dit meer geen omdat zoals waar "
+        "Het besturingssysteem beheert het geheugen van elk proces en "
+        "plant de threads die klaar zijn om uit te voeren. Wanneer een "
+        "pagina niet in het geheugen staat, laadt het systeem deze van de "
+        "schijf en werkt het de tabel bij. Deze sectie beschrijft de "
+        "volgende belangrijke begrippen, met een voorbeeld dat laat zien "
+        "hoe informatie wordt opgeslagen, overgedragen en gebruikt door "
+        "verschillende toepassingen. Welke van deze uitspraken is waar? "
+        "Wat zijn de voordelen en de nadelen van deze aanpak? De prestaties "
+        "hangen af van het aantal bewerkingen en de structuur van de "
+        "gegevens, en van de communicatie tussen de onderdelen."
+    ),
+}
+
+_NON_LETTERS = re.compile(r"[^\w]+|[\d_]+")
+
+
+def _count_trigrams(text: str) -> Counter:
+    trigrams: Counter = Counter()
+    for word in _NON_LETTERS.sub(" ", text.lower()).split():
+        padded = f" {word} "
+        trigrams.update(padded[i: i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+@functools.lru_cache(maxsize=None)
+def _get_profiles() -> Dict[str, Dict[str, float]]:
+    # log-probabilities of the trigrams of each language, smoothed over the
+    # trigrams of all the languages so that the profiles are comparable; the
+    # trigrams missing from a profile get the log-probability of the key ""
+    counts = {
+        language: _count_trigrams(sample)
+        for language, sample in _SAMPLES.items()
+    }
+    vocabulary_size = len(set().union(*counts.values())) + 1
+
+    profiles = {}
+    for language, trigrams in counts.items():
+        total = sum(trigrams.values()) + vocabulary_size
+        profile = {
+            trigram: math.log((count + 1) / total)
+            for trigram, count in trigrams.items()
+        }
+        profile[""] = math.log(1 / total)
+        profiles[language] = profile
+    return profiles
+
+
+def detect_language(
+    text: str,
+    *,
+    min_number_of_trigrams: int = 20,
+    english_margin: float = 0.1,
+) -> Optional[str]:
+    """
+    Detect the language of a text.
+
+    Technical terms borrowed from English (or from Latin) make English text
+    resemble other languages, so another language is only detected if it is
+    clearly more likely than English.
+
+    Args
+    ----
+    text (str): Text.
+    min_number_of_trigrams (int): Texts with fewer letter trigrams are too\
+        short to be identified.
+    english_margin (float): Average log-likelihood per trigram by which\
+        another language must be more likely than English to be detected.
+
+    Returns
+    -------
+    Optional[str]
+        Lowercase English name of the language (for example, 'english' or
+        'turkish'), or None if the text is too short to be identified.
+    """
+    trigrams = _count_trigrams(text)
+    number_of_trigrams = sum(trigrams.values())
+    if number_of_trigrams < min_number_of_trigrams:
+        return None
+
+    def log_likelihood(language: str) -> float:
+        profile = _get_profiles()[language]
+        unknown = profile[""]
+        score = sum(
+            count * profile.get(trigram, unknown)
+            for trigram, count in trigrams.items()
+        )
+        if language == "english":
+            score += english_margin * number_of_trigrams
+        return score
+
+    return max(_SAMPLES, key=log_likelihood)
@@ -0,0 +1,105 @@
+"""
+Configuration of the LLM used by each stage of the generation.
+
+Naming a topic or picking the letters of the correct answers needs far fewer
+output tokens and less reasoning than writing questions, so each stage can be
+sent to a different (for example, faster) model.
+"""
+
+from typing import Dict, NamedTuple, Optional
+
+DEFAULT_LLM_MODEL = "gemini-1.5-flash-latest"
+
+# stages of the generation, in the order they run
+TOPICS = "topic"
+QUESTIONS = "question"
+OPTIONS = "option"
+ANSWER_KEY = "answer-key"
+STAGES = (TOPICS, QUESTIONS, OPTIONS, ANSWER_KEY)
+
+STAGE_DESCRIPTIONS = {
+    TOPICS: "naming the topics",
+    QUESTIONS: "generating the questions",
+    OPTIONS: "generating the multiple choice answers",
+    ANSWER_KEY: "choosing the correct answers",
+}
+
+
+class ModelConfig(NamedTuple):
+    """
+    Configuration of an LLM.
+
+    Args
+    ----
+    model (str): Name of the model.
+    temperature (Optional[float]): Sampling temperature. If None, the\
+        default of the model is used.
+    max_output_tokens (Optional[int]): Maximum number of tokens to generate.\
+        If None, the default of the model is used.
+    max_retries (int): Maximum number of retries of a failed request.
+    """
+
+    model: str = DEFAULT_LLM_MODEL
+    temperature: Optional[float] = None
+    max_output_tokens: Optional[int] = None
+    max_retries: int = 6
+
+
+# topic names are only a few words long
+DEFAULT_STAGE_MAX_OUTPUT_TOKENS: Dict[str, Optional[int]] = {TOPICS: 5}
+
+
+def get_stage_model_configs(
+    *,
+    default_model: str = DEFAULT_LLM_MODEL,
+    default_max_retries: int = 6,
+    models: Optional[Dict[str, Optional[str]]] = None,
+    temperatures: Optional[Dict[str, Optional[float]]] = None,
+    max_output_tokens: Optional[Dict[str, Optional[int]]] = None,
+    max_retries: Optional[Dict[str, Optional[int]]] = None,
+) -> Dict[str, ModelConfig]:
+    """
+    Get the model configuration of each stage.
+
+    Args
+    ----
+    default_model (str): Model of the stages without a model.
+    default_max_retries (int): Maximum number of retries of the stages\
+        without one.
+    models (Optional[Dict[str, Optional[str]]]): Model of each stage.
+    temperatures (Optional[Dict[str, Optional[float]]]): Temperature of\
+        each stage.
+    max_output_tokens (Optional[Dict[str, Optional[int]]]): Maximum number\
+        of output tokens of each stage.
+    max_retries (Optional[Dict[str, Optional[int]]]): Maximum number of\
+        retries of each stage.
+
+    Returns
+    -------
+    Dict[str, ModelConfig]
+        Model configuration of each stage in `STAGES`.
+    """
+    models = models or {}
+    temperatures = temperatures or {}
+    max_output_tokens = max_output_tokens or {}
+    max_retries = max_retries or {}
+
+    configs = {}
+    for stage in STAGES:
+        stage_max_output_tokens = max_output_tokens.get(stage)
+        stage_max_retries = max_retries.get(stage)
+        configs[stage] = ModelConfig(
+            model=models.get(stage) or default_model,
+            temperature=temperatures.get(stage),
+            max_output_tokens=(
+                stage_max_output_tokens
+                if stage_max_output_tokens is not None
+                else DEFAULT_STAGE_MAX_OUTPUT_TOKENS.get(stage)
+            ),
+            max_retries=(
+                stage_max_retries
+                if stage_max_retries is not None
+                else default_max_retries
+            ),
+        )
+    return configs
@@ -0,0 +1,357 @@
+"""
+Loading of PDF files with the text of their images.
+
+Slide templates put the same images (logos, backgrounds) on every page, so
+the images are hashed and each distinct image is extracted with OCR only
+once, in a process pool. The extracted text is cached on disk by image hash,
+so rerunning on the same files, or on files sharing a template, does not
+extract it again.
+"""
+
+import functools
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents.base import Document
+from pypdf import PdfReader
+from tqdm import tqdm
+
+DEFAULT_OCR_CACHE_DIRECTORY = os.path.join(
+    os.path.expanduser("~"), ".cache", "slides2questions", "ocr"
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_ocr_engine():
+    from rapidocr_onnxruntime import RapidOCR
+
+    return RapidOCR()
+
+
+class _PdfImage(NamedTuple):
+    """
+    Image of a PDF page.
+
+    Args
+    ----
+    source (str): Path of the PDF file.
+    page_number (int): Index of the page.
+    image_id (Tuple[str, ...]): Names of the image XObject, preceded by the\
+        names of the forms containing it.
+    """
+
+    source: str
+    page_number: int
+    image_id: Tuple[str, ...]
+
+
+@functools.lru_cache(maxsize=4)
+def _get_pdf_reader(source: str) -> PdfReader:
+    return PdfReader(source)
+
+
+def _extract_text_from_image(image: _PdfImage) -> str:
+    # runs in the worker processes, each of them loads the OCR engine once
+    # and decodes the images itself
+    try:
+        page = _get_pdf_reader(image.source).pages[image.page_number]
+        data = page.images[list(image.image_id)].data
+    except Exception:
+        # unsupported or corrupted image
+        return ""
+    result, _ = _get_ocr_engine()(data)
+    if not result:
+        return ""
+    return "\n".join(text for _, text, _ in result)
+
+
+class OCRCache:
+    """
+    Text extracted from images, stored in a directory with one file per
+    image hash.
+
+    Args
+    ----
+    directory (str): Directory of the cache, created if it does not exist.
+    """
+
+    def __init__(self, directory: str = DEFAULT_OCR_CACHE_DIRECTORY) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, image_hash: str) -> str:
+        return os.path.join(self.directory, f"{image_hash}.txt")
+
+    def get(self, image_hash: str) -> Optional[str]:
+        try:
+            with open(self._path(image_hash), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, image_hash: str, text: str) -> None:
+        # write to a temporary file first, so that concurrent runs never
+        # read a partially written entry
+        path = self._path(image_hash)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temporary_path, path)
+
+
+def _iter_image_xobjects(
+    resources: Any, image_id: Tuple[str, ...] = ()
+) -> Iterator[Tuple[Tuple[str, ...], Any]]:
+    # image XObjects of a page, including those of its forms (like the
+    # images of `PageObject.images`, without decoding them)
+    if resources is None:
+        return
+    x_objects = resources.get_object().get("/XObject")
+    if x_objects is None:
+        return
+    for name, x_object in x_objects.get_object().items():
+        x_object = x_object.get_object()
+        subtype = x_object.get("/Subtype")
+        if subtype == "/Image":
+            yield (*image_id, name), x_object
+        elif subtype == "/Form" and name not in image_id:
+            yield from _iter_image_xobjects(
+                x_object.get("/Resources"), (*image_id, name)
+            )
+
+
+def _collect_images(
+    sources: List[str], *, min_image_area: int
+) -> Tuple[Dict[Tuple[str, int], List[str]], Dict[str, _PdfImage]]:
+    """
+    Collect the images of the PDF files.
+
+    The size of an image is read from its dictionary, and the images are
+    hashed without being decoded: they are only decoded by the processes
+    extracting their text.
+
+    Args
+    ----
+    sources (List[str]): Paths of the PDF files.
+    min_image_area (int): Images with fewer pixels are skipped.
+
+    Returns
+    -------
+    Tuple[Dict[Tuple[str, int], List[str]], Dict[str, _PdfImage]]
+        Distinct hashes of the images on each (source, page number), and
+        the location of each distinct image by hash.
+    """
+    page_images: Dict[Tuple[str, int], List[str]] = {}
+    images: Dict[str, _PdfImage] = {}
+    for source in sources:
+        for page_number, page in enumerate(PdfReader(source).pages):
+            hashes = page_images.setdefault((source, page_number), [])
+            for image_id, x_object in _iter_image_xobjects(
+                page.get("/Resources")
+            ):
+                try:
+                    width = int(x_object.get("/Width", 0))
+                    height = int(x_object.get("/Height", 0))
+                    if width * height < min_image_area:
+                        continue
+                    image_hash = hashlib.sha256(
+                        x_object.get_data()
+                    ).hexdigest()
+                except Exception:
+                    # unsupported or corrupted image
+                    continue
+                # an image repeated on a page is extracted once
+                if image_hash in hashes:
+                    continue
+                images.setdefault(
+                    image_hash, _PdfImage(source, page_number, image_id)
+                )
+                hashes.append(image_hash)
+    return page_images, images
+
+
+def ocr_images(
+    images: Dict[str, _PdfImage],
+    *,
+    cache: OCRCache,
+    max_workers: Optional[int] = None,
+    verbose: bool = False,
+) -> Dict[str, str]:
+    """
+    Extract the text of the images that are not in the cache.
+
+    Args
+    ----
+    images (Dict[str, _PdfImage]): Location of the images by hash.
+    cache (OCRCache): Cache of the extracted text.
+    max_workers (Optional[int]): Number of processes extracting text.\
+        If None, the number of CPUs is used.
+    verbose (bool): Whether to print how many images were extracted.
+
+    Returns
+    -------
+    Dict[str, str]
+        Text of the images by hash.
+    """
+    texts: Dict[str, str] = {}
+    missing: List[str] = []
+    for image_hash in images:
+        text = cache.get(image_hash)
+        if text is None:
+            missing.append(image_hash)
+        else:
+            texts[image_hash] = text
+
+    if verbose:
+        print(
+            f"Extracting text from {len(missing)} images "
+            f"({len(texts)} found in the OCR cache)"
+        )
+
+    if missing:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            extracted_texts = executor.map(
+                _extract_text_from_image,
+                (images[image_hash] for image_hash in missing),
+            )
+            for image_hash, text in tqdm(
+                zip(missing, extracted_texts),
+                total=len(missing),
+                desc="Extracting text from images",
+                unit="image",
+            ):
+                cache.set(image_hash, text)
+                texts[image_hash] = text
+
+    return texts
+
+
+def list_pdf_files(pdf_directory: str) -> List[str]:
+    """
+    List the PDF files in a directory.
+
+    Args
+    ----
+    pdf_directory (str): Directory containing the PDF files.
+
+    Returns
+    -------
+    List[str]
+        Paths of the PDF files, skipping the hidden files, in order.
+    """
+    return sorted(
+        str(path)
+        for path in Path(pdf_directory).glob("*.pdf")
+        if path.is_file() and not path.name.startswith(".")
+    )
+
+
+def load_pdf_files(
+    file_paths: List[str],
+    *,
+    extract_text_from_images: bool = False,
+    min_image_area: int = 2500,
+    max_workers: Optional[int] = None,
+    ocr_cache_directory: str = DEFAULT_OCR_CACHE_DIRECTORY,
+    verbose: bool = False,
+) -> List[Document]:
+    """
+    Load the pages of PDF files.
+
+    Args
+    ----
+    file_paths (List[str]): Paths of the PDF files.
+    extract_text_from_images (bool): Whether to add the text of the images\
+        to the pages (requires `pip install rapidocr-onnxruntime`).
+    min_image_area (int): Images with fewer pixels are skipped.
+    max_workers (Optional[int]): Number of processes extracting text from\
+        images. If None, the number of CPUs is used.
+    ocr_cache_directory (str): Directory of the cache of the text extracted\
+        from images.
+    verbose (bool): Whether to print more information.
+
+    Returns
+    -------
+    List[Document]
+        Pages of the PDF files, with the text of their images appended. The
+        files that cannot be read are skipped.
+    """
+    documents = []
+    for file_path in file_paths:
+        try:
+            documents.extend(PyPDFLoader(file_path).load())
+        except Exception as error:
+            # corrupted, encrypted or removed file
+            print(f"Skipping {file_path}: {error}")
+    if not extract_text_from_images or not documents:
+        return documents
+
+    sources = list(
+        dict.fromkeys(document.metadata["source"] for document in documents)
+    )
+    page_images, images = _collect_images(
+        sources, min_image_area=min_image_area
+    )
+    texts = ocr_images(
+        images,
+        cache=OCRCache(ocr_cache_directory),
+        max_workers=max_workers,
+        verbose=verbose,
+    )
+
+    pages_with_images = []
+    for document in documents:
+        image_hashes = page_images.get(
+            (document.metadata["source"], document.metadata["page"]), []
+        )
+        image_texts = [texts[h] for h in image_hashes if texts[h]]
+        if image_texts:
+            document = Document(
+                page_content="\n".join([document.page_content, *image_texts]),
+                metadata=document.metadata,
+            )
+        pages_with_images.append(document)
+    return pages_with_images
+
+
+def load_pdfs(
+    pdf_directory: str,
+    *,
+    extract_text_from_images: bool = False,
+    min_image_area: int = 2500,
+    max_workers: Optional[int] = None,
+    ocr_cache_directory: str = DEFAULT_OCR_CACHE_DIRECTORY,
+    verbose: bool = False,
+) -> List[Document]:
+    """
+    Load the pages of the PDF files in a directory.
+
+    Args
+    ----
+    pdf_directory (str): Directory containing the PDF files.
+    extract_text_from_images (bool): Whether to add the text of the images\
+        to the pages (requires `pip install rapidocr-onnxruntime`).
+    min_image_area (int): Images with fewer pixels are skipped.
+    max_workers (Optional[int]): Number of processes extracting text from\
+        images. If None, the number of CPUs is used.
+    ocr_cache_directory (str): Directory of the cache of the text extracted\
+        from images.
+    verbose (bool): Whether to print more information.
+
+    Returns
+    -------
+    List[Document]
+        Pages of the PDF files, with the text of their images appended.
+    """
+    return load_pdf_files(
+        list_pdf_files(pdf_directory),
+        extract_text_from_images=extract_text_from_images,
+        min_image_area=min_image_area,
+        max_workers=max_workers,
+        ocr_cache_directory=ocr_cache_directory,
+        verbose=verbose,
+    )
@@ -0,0 +1,352 @@
+"""
+Fast parsing of LLM responses.
+
+The responses are stripped of markdown with precompiled patterns in a single
+pass over their lines, instead of rendering them to HTML and parsing the HTML
+back into text.
+"""
+
+import functools
+import html
+import re
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+# block level markdown
+_FENCE = re.compile(r"^\s*(?:```|~~~)")
+_HEADING = re.compile(r"^\s{0,3}#{1,6}\s+(.*?)(?:\s+#+)?\s*$")
+_SETEXT_UNDERLINE = re.compile(r"^\s{0,3}=+\s*$")
+_HORIZONTAL_RULE = re.compile(r"^\s{0,3}([-*_])(?:\s*\1){2,}\s*$")
+_BLOCKQUOTE = re.compile(r"^\s{0,3}>\s?")
+_LIST_ITEM = re.compile(r"^\s*(?:[*+-]|\d+\.)\s+")
+_INDENTED_CODE = re.compile(r"^(?: {4}|\t)")
+
+# inline markdown
+_IMAGE_OR_LINK = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+_CODE_SPAN = re.compile(r"`+([^`]*)`+")
+_STRONG = re.compile(r"(\*\*|__)(?=\S)(.+?)(?<=\S)\1")
+_EMPHASIS = re.compile(r"(?<![\w*])([*_])(?=\S)(.+?)(?<=\S)\1(?![\w*])")
+_HTML_TAG = re.compile(r"</?[A-Za-z][^>]*>")
+_ESCAPE = re.compile(r"\\([\\`*_{}\[\]()#+\-.!>])")
+_HELD_CODE_SPAN = re.compile("\ue000(\\d+)\ue001")
+
+# response post-processing
+_REFERENCE_AT_LINE_END = re.compile(r"\(.*\) *\n+")
+_ANSWER_OPTION = re.compile(r"^\s*[a-zA-Z]\s*\)")
+
+# kinds of the lines yielded by `_iter_lines`
+_CONTINUATION = "continuation"
+_PARAGRAPH = "paragraph"
+_LIST_ITEM_BLOCK = "list"
+_CODE_BLOCK = "code"
+
+
+def _strip_inline_markdown(line: str) -> str:
+    line = _IMAGE_OR_LINK.sub(r"\1", line)
+
+    # the content of code spans is kept as is, entities included
+    code_spans: List[str] = []
+
+    def hold_code_span(match: re.Match) -> str:
+        code_spans.append(match.group(1))
+        return f"\ue000{len(code_spans) - 1}\ue001"
+
+    if "`" in line:
+        line = _CODE_SPAN.sub(hold_code_span, line)
+    line = _STRONG.sub(r"\2", line)
+    line = _EMPHASIS.sub(r"\2", line)
+    line = _HTML_TAG.sub("", line)
+    line = _ESCAPE.sub(r"\1", line)
+    if "&" in line:
+        line = html.unescape(line)
+    if code_spans:
+        line = _HELD_CODE_SPAN.sub(
+            lambda match: code_spans[int(match.group(1))], line
+        )
+    return line
+
+
+def _iter_lines(text: str) -> Iterator[Tuple[str, str]]:
+    """
+    Yield the lines of a markdown text without the markdown syntax.
+
+    Args
+    ----
+    text (str): Text with markdown.
+
+    Returns
+    -------
+    Iterator[Tuple[str, str]]
+        Pairs of (block kind, line). The kind is 'continuation' for lines
+        continuing the previous block, 'list' for list items, 'code' for
+        indented code blocks and 'paragraph' for any other block.
+    """
+    in_fenced_code = False
+    in_indented_code = False
+    blank_lines_in_code = 0
+    kind = _PARAGRAPH
+    after_blank_line = True
+    # whether the previous line is the first line of a paragraph, which a
+    # setext underline turns into a heading
+    heading_candidate = False
+    # indented lines after an empty line in a list continue the list item
+    in_list = False
+    for line in text.split("\n"):
+        if in_indented_code:
+            if not line.strip():
+                blank_lines_in_code += 1
+                continue
+            if _INDENTED_CODE.match(line):
+                for _ in range(blank_lines_in_code):
+                    yield _CONTINUATION, ""
+                blank_lines_in_code = 0
+                yield _CONTINUATION, _INDENTED_CODE.sub("", line, count=1)
+                continue
+            in_indented_code = False
+            kind = _PARAGRAPH
+            after_blank_line = True
+
+        if _FENCE.match(line):
+            in_fenced_code = not in_fenced_code
+            kind = _PARAGRAPH
+            heading_candidate = False
+            continue
+        if in_fenced_code:
+            yield kind, line
+            kind = _CONTINUATION
+            continue
+        if not line.strip() or _HORIZONTAL_RULE.match(line):
+            kind = _PARAGRAPH
+            after_blank_line = True
+            heading_candidate = False
+            continue
+
+        if after_blank_line and not in_list and _INDENTED_CODE.match(line):
+            # indented code is not rendered, not even its entities
+            in_indented_code = True
+            blank_lines_in_code = 0
+            kind = _CONTINUATION
+            heading_candidate = False
+            yield _CODE_BLOCK, _INDENTED_CODE.sub("", line, count=1)
+            continue
+
+        if heading_candidate and _SETEXT_UNDERLINE.match(line):
+            kind = _PARAGRAPH
+            after_blank_line = True
+            heading_candidate = False
+            continue
+
+        if heading := _HEADING.match(line):
+            yield _PARAGRAPH, _strip_inline_markdown(heading.group(1))
+            kind = _PARAGRAPH
+            after_blank_line = True
+            heading_candidate = False
+            in_list = False
+            continue
+
+        line = _BLOCKQUOTE.sub("", line)
+        if list_item := _LIST_ITEM.match(line):
+            kind = _LIST_ITEM_BLOCK
+            line = line[list_item.end():]
+
+        if kind != _CONTINUATION:
+            in_list = kind == _LIST_ITEM_BLOCK
+        heading_candidate = kind == _PARAGRAPH
+        after_blank_line = False
+        yield kind, _strip_inline_markdown(line)
+        kind = _CONTINUATION
+
+
+def strip_markdown(text: str) -> str:
+    """
+    Remove markdown from text.
+
+    Lines are separated like in the text of the rendered HTML: blocks are
+    separated by a single newline, except that lists are separated from the
+    surrounding blocks by an empty line and end with a newline, and that
+    code blocks end with a newline.
+
+    Unlike the rendered HTML, a list directly following a paragraph (without
+    an empty line in between) is a list rather than a continuation of the
+    paragraph, so its markers are removed and its items are not merged into
+    the sentence of the paragraph.
+
+    Args
+    ----
+    text (str): Text with markdown.
+
+    Returns
+    -------
+    str
+        Text without markdown.
+    """
+    lines: List[str] = []
+    previous_kind = None
+    for kind, line in _iter_lines(text):
+        if kind == _CONTINUATION:
+            lines.append(line)
+            continue
+
+        if previous_kind == _CODE_BLOCK:
+            lines.append("")
+        elif previous_kind is not None and (kind == _LIST_ITEM_BLOCK) != (
+            previous_kind == _LIST_ITEM_BLOCK
+        ):
+            lines.append("")
+        lines.append(line)
+        previous_kind = kind
+
+    if previous_kind in (_LIST_ITEM_BLOCK, _CODE_BLOCK):
+        # the rendered HTML of a list or a code block ends with a newline
+        lines.append("")
+
+    return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize=None)
+def get_sentence_tokenizer() -> Callable[[str], List[str]]:
+    """
+    Get the sentence tokenizer, downloading its data only if it is missing.
+
+    Returns
+    -------
+    Callable[[str], List[str]]
+        Function splitting a text into sentences.
+    """
+    import nltk
+    from nltk.tokenize import sent_tokenize
+
+    try:
+        nltk.data.find("tokenizers/punkt")
+    except LookupError:
+        nltk.download("punkt", quiet=True, raise_on_error=True)
+
+    return sent_tokenize
+
+
+def extract_questions(llm_response: str, negative_response: str) -> List[str]:
+    """
+    Extract questions from the LLM response.
+
+    Args
+    ----
+    llm_response (str): LLM response.
+    negative_response (str): Text to
+        check if the response is negative.
+
+    Returns
+    -------
+    List[str]
+        List of questions extracted from the LLM response.
+    """
+    # check if the response is negative
+    if negative_response.lower() in llm_response.lower():
+        return []
+
+    # a colon ending the paragraph before a list ends the sentence
+    text = strip_markdown(llm_response).replace(":\n\n", ".\n")
+
+    # remove "(...)" at the end of lines
+    text = _REFERENCE_AT_LINE_END.sub("", text)
+
+    sent_tokenize = get_sentence_tokenizer()
+    return [
+        sentence
+        for sentence in sent_tokenize(text)
+        if sentence.endswith("?")
+    ]
+
+
+def iter_questions(
+    llm_response_chunks: Iterable[str], negative_response: str
+) -> Iterator[str]:
+    """
+    Extract questions from a streamed LLM response as soon as they are
+    complete.
+
+    A question is complete once the line it ends on is complete, so the
+    received lines are parsed whenever a chunk contains a newline. Only the
+    lines after the last line ending with a question mark (outside code
+    blocks) are parsed again, as the sentences before it are complete. The
+    questions yielded are the same as the ones `extract_questions` returns
+    for the whole response, unless the negative response comes after some
+    questions.
+
+    Args
+    ----
+    llm_response_chunks (Iterable[str]): Chunks of the LLM response.
+    negative_response (str): Text to
+        check if the response is negative.
+
+    Returns
+    -------
+    Iterator[str]
+        Questions extracted from the LLM response.
+    """
+    negative_response = negative_response.lower()
+    # text received after the last complete question
+    pending = ""
+    # end of the text before `pending`, to find a negative response
+    # overlapping both
+    parsed_tail = ""
+    number_of_questions = 0
+    for chunk in llm_response_chunks:
+        pending += chunk
+        if "\n" not in chunk:
+            continue
+
+        complete_lines = pending[: pending.rindex("\n") + 1]
+        if negative_response in (parsed_tail + complete_lines).lower():
+            return
+        questions = extract_questions(complete_lines, negative_response)
+        yield from questions[number_of_questions:]
+        number_of_questions = max(number_of_questions, len(questions))
+
+        fences = sum(
+            1 for line in complete_lines.split("\n") if _FENCE.match(line)
+        )
+        if complete_lines.rstrip().endswith("?") and fences % 2 == 0:
+            parsed_tail = (parsed_tail + complete_lines)[
+                -len(negative_response):
+            ]
+            pending = pending[len(complete_lines):]
+            number_of_questions = 0
+
+    if negative_response in (parsed_tail + pending).lower():
+        return
+    questions = extract_questions(pending, negative_response)
+    yield from questions[number_of_questions:]
+
+
+def extract_answers(
+    llm_response: str,
+    *,
+    negative_response: str,
+    max_number_of_answers: int,
+) -> List[str]:
+    """
+    Extract lettered answers (for example, 'A) Answer') from the LLM response.
+
+    Args
+    ----
+    llm_response (str): LLM response.
+    negative_response (str): Text to\
+        check if the response is negative.
+    max_number_of_answers (int): Maximum number of answers.
+
+    Returns
+    -------
+    List[str]
+        List of answers extracted from the LLM response.
+    """
+    # check if the response is negative
+    if negative_response.lower() in llm_response.lower():
+        return []
+
+    answers: List[str] = []
+    for _, line in _iter_lines(llm_response):
+        if len(answers) >= max_number_of_answers:
+            break
+        if _ANSWER_OPTION.match(line):
+            answers.append(line.strip())
+
+    return answers
@@ -0,0 +1,171 @@
+"""
+Removal of the boilerplate in the loaded pages.
+
+Slide decks repeat title, agenda and "Questions?" slides, and headers and
+footers on every page. Removing them before topic extraction, translation and
+embedding shrinks the corpus every downstream step works on.
+"""
+
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Set
+
+from langchain_core.documents.base import Document
+
+from deduplication import find_near_duplicate_clusters, get_shingles
+
+_DIGITS = re.compile(r"\d+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize_line(line: str) -> str:
+    # page numbers and dates change from page to page in headers and footers
+    return _DIGITS.sub("#", _WHITESPACE.sub(" ", line.strip().lower()))
+
+
+def remove_repeated_lines(
+    documents: List[Document],
+    *,
+    max_page_frequency: float = 0.5,
+    min_number_of_pages: int = 4,
+) -> List[Document]:
+    """
+    Remove the lines that repeat across most pages of the same source, such
+    as headers and footers.
+
+    Args
+    ----
+    documents (List[Document]): Pages.
+    max_page_frequency (float): Lines appearing in more than this fraction\
+        of the pages of a source are removed from them.
+    min_number_of_pages (int): Sources with fewer pages are left as they are.
+
+    Returns
+    -------
+    List[Document]
+        Pages without the repeated lines.
+    """
+    pages_by_source: Dict[str, List[int]] = defaultdict(list)
+    for i, document in enumerate(documents):
+        pages_by_source[document.metadata.get("source", "")].append(i)
+
+    repeated_lines: Dict[str, Set[str]] = {}
+    for source, pages in pages_by_source.items():
+        if len(pages) < min_number_of_pages:
+            repeated_lines[source] = set()
+            continue
+        page_frequency = Counter(
+            line
+            for i in pages
+            for line in {
+                _normalize_line(line)
+                for line in documents[i].page_content.splitlines()
+            }
+            if line
+        )
+        repeated_lines[source] = {
+            line
+            for line, frequency in page_frequency.items()
+            if frequency / len(pages) > max_page_frequency
+        }
+
+    cleaned_documents = []
+    for document in documents:
+        repeated = repeated_lines[document.metadata.get("source", "")]
+        if not repeated:
+            cleaned_documents.append(document)
+            continue
+        page_content = "\n".join(
+            line
+            for line in document.page_content.splitlines()
+            if _normalize_line(line) not in repeated
+        )
+        cleaned_documents.append(
+            Document(page_content=page_content, metadata=document.metadata)
+        )
+    return cleaned_documents
+
+
+def remove_near_duplicate_pages(
+    documents: List[Document], *, threshold: float = 0.8
+) -> List[Document]:
+    """
+    Remove the empty pages and the near-duplicate pages, in any source.
+
+    Slide decks often build a slide up one bullet per page, so the most
+    complete page of each group of near-duplicates (the one with the most
+    distinct shingles, or the first one on ties) is kept.
+
+    Args
+    ----
+    documents (List[Document]): Pages.
+    threshold (float): Similarity (between 0 and 1) above which two pages\
+        are near-duplicates.
+
+    Returns
+    -------
+    List[Document]
+        Most complete page of each group of near-duplicate pages, at the
+        position of the first page of the group.
+    """
+    documents = [
+        document for document in documents if document.page_content.strip()
+    ]
+    clusters = find_near_duplicate_clusters(
+        [document.page_content for document in documents],
+        threshold=threshold,
+    )
+    return [
+        documents[
+            max(
+                cluster,
+                key=lambda i: (
+                    len(get_shingles(documents[i].page_content)),
+                    -i,
+                ),
+            )
+        ]
+        for cluster in clusters
+    ]
+
+
+def remove_boilerplate(
+    documents: List[Document],
+    *,
+    duplicate_page_threshold: float = 0.8,
+    verbose: bool = False,
+) -> List[Document]:
+    """
+    Remove the repeated lines, and then the near-duplicate pages.
+
+    Args
+    ----
+    documents (List[Document]): Pages.
+    duplicate_page_threshold (float): Similarity (between 0 and 1) above\
+        which two pages are near-duplicates.
+    verbose (bool): Whether to print how much of the text was removed.
+
+    Returns
+    -------
+    List[Document]
+        Pages without boilerplate.
+    """
+    cleaned_documents = remove_near_duplicate_pages(
+        remove_repeated_lines(documents), threshold=duplicate_page_threshold
+    )
+
+    if verbose:
+        number_of_characters = sum(
+            len(document.page_content) for document in documents
+        )
+        number_of_cleaned_characters = sum(
+            len(document.page_content) for document in cleaned_documents
+        )
+        print(
+            f"Removed {len(documents) - len(cleaned_documents)} duplicate or "
+            f"empty pages and "
+            f"{number_of_characters - number_of_cleaned_characters} "
+            "characters of boilerplate"
+        )
+
+    return cleaned_documents
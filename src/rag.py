@@ -1,19 +1,101 @@
 import sys
 import textwrap
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional
 
 from dotenv import load_dotenv
 from langchain.chains.retrieval_qa.base import BaseRetrievalQA, RetrievalQA
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFDirectoryLoader
 from langchain_community.vectorstores.chroma import Chroma
 from langchain_core.documents.base import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.prompts import format_document
 from langchain_core.runnables.config import RunnableConfig
+from langchain_core.vectorstores import VectorStore
 from langchain_google_genai import (
     GoogleGenerativeAI,
     GoogleGenerativeAIEmbeddings,
 )
 
+from budget import charge_llm_call, check_budget, estimate_tokens
+from chunking import chunk_pages
+from models import DEFAULT_LLM_MODEL, ModelConfig
+from resilience import EMBEDDING_CALLS, LLM_CALLS, get_caller
+from topic_extraction import get_topic_metadata_key
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+NUMBER_OF_RETRIEVED_CHUNKS = 3
+
+
+class ResilientEmbeddings(Embeddings):
+    """
+    Embeddings requested through the resilient caller of the embeddings, in
+    batches, so that a slow batch is hedged or abandoned on its own.
+
+    Args
+    ----
+    embeddings (Embeddings): Embeddings to request.
+    batch_size (int): Number of texts embedded per request.
+    """
+
+    def __init__(self, embeddings: Embeddings, *, batch_size: int = 100):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        caller = get_caller(EMBEDDING_CALLS)
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(
+                caller.call(
+                    self.embeddings.embed_documents,
+                    texts[start: start + self.batch_size],
+                )
+            )
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return get_caller(EMBEDDING_CALLS).call(
+            self.embeddings.embed_query, text
+        )
+
+
+def update_vector_store(
+    vector_store: Chroma,
+    documents: List[Document],
+    *,
+    replaced_sources: List[str],
+) -> None:
+    """
+    Replace the chunks of some sources in a vector store.
+
+    Only the chunks of the new documents are embedded. They are added before
+    the chunks of the replaced sources are deleted, so if embedding them
+    fails the vector store still has the previous chunks, and replacing the
+    same sources again also deletes the chunks added by the failed attempt.
+
+    Args
+    ----
+    vector_store (Chroma): Vector store created by `get_vector_store`.
+    documents (List[Document]): New pages to add.
+    replaced_sources (List[str]): Sources whose chunks are removed (the\
+        modified and the removed files).
+    """
+    replaced_ids = [
+        chunk_id
+        for source in replaced_sources
+        for chunk_id in vector_store.get(where={"source": source})["ids"]
+    ]
+
+    chunks = chunk_pages(
+        documents, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+    )
+    if chunks:
+        vector_store.add_documents(chunks)
+
+    if replaced_ids:
+        vector_store.delete(ids=replaced_ids)
+
 
 def create_vector_store(texts, embeddings):
     vectore_store = Chroma.from_documents(
@@ -22,30 +104,23 @@ def create_vector_store(texts, embeddings):
     return vectore_store
 
 
-def get_retrieval_qa_chain(
-    documents: List[Document],
-    *,
-    llm_model_name: str = "gemini-1.5-flash-latest",
-    max_retries: int = 6,
-) -> BaseRetrievalQA:
+def get_vector_store(documents: List[Document]) -> VectorStore:
     """
-    Get a retrieval QA chain for interacting with the provided documents.
+    Embed the provided documents in a vector store.
 
     Args
     ----
-    documents (List[Document]): List of documents to interact with.
+    documents (List[Document]): List of documents to embed.
 
     Returns
     -------
-    BaseRetrievalQA
-        Retrieval QA chain for interacting with the provided documents.
+    VectorStore
+        Vector store of the chunks of the documents.
     """
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000, chunk_overlap=200
+    texts = chunk_pages(
+        documents, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
     )
 
-    texts = text_splitter.split_documents(documents)
-
     embeddings = GoogleGenerativeAIEmbeddings(
         model="models/text-embedding-004",
         task_type=None,
@@ -56,25 +131,138 @@ def get_retrieval_qa_chain(
         request_options=None,
     )
 
-    vector_store = create_vector_store(texts, embeddings)
+    return create_vector_store(texts, ResilientEmbeddings(embeddings))
 
-    retrieval_engine = vector_store.as_retriever(search_kwargs={"k": 3})
 
-    qa_chain_openai = RetrievalQA.from_chain_type(
-        llm=GoogleGenerativeAI(
-            model=llm_model_name,
-            client_options=None,
-            transport=None,
-            additional_headers=None,
-            client=None,
-            max_retries=max_retries,
-        ),
+def get_llm(model_config: ModelConfig) -> GoogleGenerativeAI:
+    # leave the parameters that are not set to the defaults of the model
+    optional_parameters: Dict[str, Any] = {
+        name: value
+        for name, value in (
+            ("temperature", model_config.temperature),
+            ("max_output_tokens", model_config.max_output_tokens),
+        )
+        if value is not None
+    }
+    return GoogleGenerativeAI(
+        model=model_config.model,
+        client_options=None,
+        transport=None,
+        additional_headers=None,
+        client=None,
+        max_retries=model_config.max_retries,
+        **optional_parameters,
+    )
+
+
+def get_retrieval_qa_chain_from_vector_store(
+    vector_store: VectorStore, model_config: ModelConfig
+) -> BaseRetrievalQA:
+    """
+    Get a retrieval QA chain querying a vector store with the given model.
+
+    Args
+    ----
+    vector_store (VectorStore): Vector store to retrieve the context from.
+    model_config (ModelConfig): Configuration of the LLM.
+
+    Returns
+    -------
+    BaseRetrievalQA
+        Retrieval QA chain for interacting with the vector store.
+    """
+    retrieval_engine = vector_store.as_retriever(
+        search_kwargs={"k": NUMBER_OF_RETRIEVED_CHUNKS}
+    )
+
+    return RetrievalQA.from_chain_type(
+        llm=get_llm(model_config),
         chain_type="stuff",
         retriever=retrieval_engine,
         return_source_documents=True,
     )
 
-    return qa_chain_openai
+
+def get_stage_retrieval_qa_chains(
+    vector_store: VectorStore, model_configs: Dict[str, ModelConfig]
+) -> Dict[str, BaseRetrievalQA]:
+    """
+    Get a retrieval QA chain for each stage of the generation, sharing the
+    chains of the stages with the same model configuration.
+
+    Args
+    ----
+    vector_store (VectorStore): Vector store to retrieve the context from.
+    model_configs (Dict[str, ModelConfig]): Model configuration of each stage.
+
+    Returns
+    -------
+    Dict[str, BaseRetrievalQA]
+        Retrieval QA chain of each stage.
+    """
+    chains: Dict[ModelConfig, BaseRetrievalQA] = {}
+    for model_config in model_configs.values():
+        if model_config not in chains:
+            chains[model_config] = get_retrieval_qa_chain_from_vector_store(
+                vector_store, model_config
+            )
+    return {
+        stage: chains[model_config]
+        for stage, model_config in model_configs.items()
+    }
+
+
+def get_topic_retrieval_qa_chain(
+    qa_chain: BaseRetrievalQA, topic_index: int
+) -> BaseRetrievalQA:
+    """
+    Restrict the retrieval of a retrieval QA chain to the chunks of a topic.
+
+    Args
+    ----
+    qa_chain (BaseRetrievalQA): Retrieval QA chain over a vector store of\
+        chunks marked with `assign_topics_to_documents`.
+    topic_index (int): Index of the topic.
+
+    Returns
+    -------
+    BaseRetrievalQA
+        Copy of the chain retrieving only the chunks of the topic.
+    """
+    retriever = qa_chain.retriever  # type: ignore[attr-defined]
+    topic_retriever = retriever.copy(
+        update={
+            "search_kwargs": {
+                **retriever.search_kwargs,
+                "filter": {get_topic_metadata_key(topic_index): True},
+            }
+        }
+    )
+    return qa_chain.copy(update={"retriever": topic_retriever})
+
+
+def get_retrieval_qa_chain(
+    documents: List[Document],
+    *,
+    llm_model_name: str = DEFAULT_LLM_MODEL,
+    max_retries: int = 6,
+) -> BaseRetrievalQA:
+    """
+    Get a retrieval QA chain for interacting with the provided documents.
+
+    Args
+    ----
+    documents (List[Document]): List of documents to interact with.
+
+    Returns
+    -------
+    BaseRetrievalQA
+        Retrieval QA chain for interacting with the provided documents.
+    """
+    return get_retrieval_qa_chain_from_vector_store(
+        get_vector_store(documents),
+        ModelConfig(model=llm_model_name, max_retries=max_retries),
+    )
 
 
 def wrap_text_preserve_newlines(text: str, width: int = 110) -> str:
@@ -89,23 +277,142 @@ def wrap_text_preserve_newlines(text: str, width: int = 110) -> str:
     return wrapped_text
 
 
+def format_source(metadata: Dict[str, Any]) -> str:
+    if "page" not in metadata:
+        return metadata["source"]
+
+    # pages are numbered from 0 in the metadata
+    first_page = metadata["page"] + 1
+    last_page = metadata.get("page_end", metadata["page"]) + 1
+    if first_page == last_page:
+        return f"{metadata['source']} (page {first_page})"
+    return f"{metadata['source']} (pages {first_page}-{last_page})"
+
+
 def process_llm_response(llm_response: Dict[str, Any]) -> None:
     print(wrap_text_preserve_newlines(llm_response["result"]))
     print("\nSources:")
     for source in llm_response["source_documents"]:
-        print(source.metadata["source"])
+        print(format_source(source.metadata))
 
 
 def execute_query(
-    qa_chain_openai: BaseRetrievalQA, query: str
+    qa_chain_openai: BaseRetrievalQA,
+    query: str,
+    *,
+    stage: Optional[str] = None,
 ) -> Dict[str, Any]:
+    check_budget()
     chain_type_kwargs = {"query": query}
-    llm_response = qa_chain_openai.invoke(
-        chain_type_kwargs, config=RunnableConfig(max_concurrency=1)
+    llm_response, number_of_requests = get_caller(
+        LLM_CALLS, stage
+    ).call_with_request_count(
+        qa_chain_openai.invoke,
+        chain_type_kwargs,
+        config=RunnableConfig(max_concurrency=1),
+    )
+    charge_llm_call(
+        query,
+        *(
+            document.page_content
+            for document in llm_response.get("source_documents", [])
+        ),
+        llm_response["result"],
+        requests=number_of_requests,
     )
     return llm_response
 
 
+def format_prompt(
+    qa_chain: BaseRetrievalQA, documents: List[Document], query: str
+) -> str:
+    """
+    Build the LLM prompt of a query, the way the chain does.
+
+    Args
+    ----
+    qa_chain (BaseRetrievalQA): Retrieval QA chain of the query.
+    documents (List[Document]): Context retrieved for the query.
+    query (str): Query.
+
+    Returns
+    -------
+    str
+        Prompt of the query.
+    """
+    # the retrieval QA chains combine the documents with a "stuff" chain
+    stuff_chain: Any = qa_chain.combine_documents_chain
+    context = stuff_chain.document_separator.join(
+        format_document(document, stuff_chain.document_prompt)
+        for document in documents
+    )
+    return stuff_chain.llm_chain.prompt.format(
+        **{stuff_chain.document_variable_name: context, "question": query}
+    )
+
+
+def estimate_context_tokens(qa_chain: BaseRetrievalQA) -> int:
+    """
+    Estimate the number of tokens a chain adds to the prompt of a query: its
+    prompt template and the retrieved chunks.
+
+    Args
+    ----
+    qa_chain (BaseRetrievalQA): Retrieval QA chain.
+
+    Returns
+    -------
+    int
+        Estimated number of tokens, for the longest chunks.
+    """
+    retriever = qa_chain.retriever  # type: ignore[attr-defined]
+    number_of_chunks = retriever.search_kwargs.get(
+        "k", NUMBER_OF_RETRIEVED_CHUNKS
+    )
+    template_tokens = estimate_tokens(format_prompt(qa_chain, [], ""))
+    return template_tokens + number_of_chunks * estimate_tokens(
+        "x" * CHUNK_SIZE
+    )
+
+
+def stream_query(
+    qa_chain: BaseRetrievalQA, query: str, *, stage: Optional[str] = None
+) -> Iterator[str]:
+    """
+    Execute a query and stream the tokens of the LLM response.
+
+    The context is retrieved and the prompt is built the same way as in
+    `execute_query`, but the response is yielded as it is generated. Closing
+    the returned iterator stops consuming the response. The stream must
+    start before the deadline of the LLM calls (see `ResilientCaller.stream`).
+
+    Args
+    ----
+    qa_chain (BaseRetrievalQA): Retrieval QA chain to query.
+    query (str): Query.
+    stage (Optional[str]): Stage making the query, whose calls are tracked\
+        together.
+
+    Returns
+    -------
+    Iterator[str]
+        Chunks of the LLM response.
+    """
+    documents = qa_chain.retriever.invoke(query)  # type: ignore[attr-defined]
+    prompt = format_prompt(qa_chain, documents, query)
+    llm = qa_chain.combine_documents_chain.llm_chain.llm  # type: ignore
+
+    check_budget()
+    chunks = []
+    try:
+        for chunk in get_caller(LLM_CALLS, stage).stream(llm.stream, prompt):
+            chunks.append(chunk)
+            yield chunk
+    finally:
+        # charged even if the stream is closed early
+        charge_llm_call(prompt, "".join(chunks))
+
+
 def main() -> int:
     load_dotenv()
 
@@ -0,0 +1,466 @@
+"""
+Deadlines, hedged requests and circuit breaking for the backend calls.
+
+A call slower than the observed p95 latency is usually stuck rather than
+busy, so a duplicate ("hedged") request is sent and the first response wins.
+Calls past their deadline are abandoned, and after too many consecutive
+failures the circuit opens: the calls fail fast until the backend had time to
+recover.
+"""
+
+import collections
+import itertools
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import (Any, Callable, Deque, Dict, Iterable, Iterator, List,
+                    Optional, Set, Tuple, TypeVar)
+
+T = TypeVar("T")
+
+# names of the callers of the backends
+LLM_CALLS = "llm"
+EMBEDDING_CALLS = "embeddings"
+
+
+class BackendUnavailable(Exception):
+    """
+    Raised when a call to a backend was not answered.
+    """
+
+
+class CallTimeout(BackendUnavailable):
+    """
+    Raised when no response was received before the deadline of a call.
+    """
+
+
+class CircuitOpen(BackendUnavailable):
+    """
+    Raised instead of calling a backend that is failing.
+
+    Args
+    ----
+    retry_after (float): Seconds until the next call is allowed.
+    """
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(
+            f"backend unavailable, retrying in {retry_after:.0f} seconds"
+        )
+        self.retry_after = retry_after
+
+
+class LatencyTracker:
+    """
+    Latencies of the most recent successful calls.
+
+    Args
+    ----
+    window (int): Number of calls to keep.
+    min_samples (int): Number of calls needed to estimate a percentile.
+    """
+
+    def __init__(self, *, window: int = 100, min_samples: int = 20) -> None:
+        self.min_samples = min_samples
+        self._latencies: Deque[float] = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """
+        Estimate a percentile of the latency.
+
+        Args
+        ----
+        fraction (float): Percentile, between 0 and 1.
+
+        Returns
+        -------
+        Optional[float]
+            Latency in seconds, or None if there are too few calls.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < self.min_samples:
+            return None
+        index = min(int(fraction * len(latencies)), len(latencies) - 1)
+        return latencies[index]
+
+
+class CircuitBreaker:
+    """
+    Stop calling a backend after consecutive failures.
+
+    After `failure_threshold` consecutive failures the circuit opens and the
+    calls fail fast for `reset_timeout` seconds. Then a single call is let
+    through: if it succeeds the circuit closes, otherwise it opens again for
+    twice as long (up to `max_reset_timeout`).
+
+    Args
+    ----
+    failure_threshold (int): Number of consecutive failures opening the\
+        circuit.
+    reset_timeout (float): Seconds the circuit stays open at first.
+    max_reset_timeout (float): Maximum number of seconds the circuit stays\
+        open.
+    """
+
+    def __init__(
+        self,
+        *,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        max_reset_timeout: float = 300.0,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self._failures = 0
+        self._current_reset_timeout = reset_timeout
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    @property
+    def retry_after(self) -> float:
+        """
+        Seconds until the backend may be called again (0 if it may be
+        called now).
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(
+                self._opened_at
+                + self._current_reset_timeout
+                - time.monotonic(),
+                0.0,
+            )
+
+    def before_call(self) -> None:
+        """
+        Raise `CircuitOpen` if the backend must not be called now.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            retry_after = (
+                self._opened_at + self._current_reset_timeout
+            ) - time.monotonic()
+            if retry_after > 0 or self._probing:
+                raise CircuitOpen(max(retry_after, 0.0))
+            # let a single call probe the backend
+            self._probing = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+            self._current_reset_timeout = self.reset_timeout
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing:
+                self._probing = False
+                self._current_reset_timeout = min(
+                    2 * self._current_reset_timeout, self.max_reset_timeout
+                )
+                self._opened_at = time.monotonic()
+            elif self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class ResilientCaller:
+    """
+    Call a backend with a deadline, hedged requests and a circuit breaker.
+
+    Args
+    ----
+    timeout (Optional[float]): Seconds after which a call is abandoned. If\
+        None, calls have no deadline.
+    hedge_percentile (Optional[float]): A duplicate request is sent when a\
+        call takes longer than this percentile of the recent latencies. If\
+        None, no duplicate requests are sent.
+    max_hedges (int): Maximum number of duplicate requests per call.
+    min_hedge_delay (float): Minimum number of seconds before sending a\
+        duplicate request.
+    latency_tracker (Optional[LatencyTracker]): Latencies of the backend.
+    circuit_breaker (Optional[CircuitBreaker]): Circuit breaker of the\
+        backend. If None, the backend is always called.
+    max_workers (int): Maximum number of requests in flight, including the\
+        abandoned ones.
+    """
+
+    def __init__(
+        self,
+        *,
+        timeout: Optional[float] = 120.0,
+        hedge_percentile: Optional[float] = 0.95,
+        max_hedges: int = 1,
+        min_hedge_delay: float = 1.0,
+        latency_tracker: Optional[LatencyTracker] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        max_workers: int = 8,
+    ) -> None:
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.max_hedges = max_hedges
+        self.min_hedge_delay = min_hedge_delay
+        self.latency_tracker = latency_tracker or LatencyTracker()
+        self.circuit_breaker = circuit_breaker
+        self.number_of_hedges = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="resilient-call"
+        )
+
+    def _hedge_delay(self) -> Optional[float]:
+        if self.hedge_percentile is None or self.max_hedges < 1:
+            return None
+        latency = self.latency_tracker.percentile(self.hedge_percentile)
+        if latency is None:
+            return None
+        return max(latency, self.min_hedge_delay)
+
+    def call(
+        self, function: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> T:
+        """
+        Call a function of the backend.
+
+        See `call_with_request_count`.
+
+        Args
+        ----
+        function (Callable[..., T]): Function sending the request.
+        args (Any): Positional arguments of the function.
+        kwargs (Any): Keyword arguments of the function.
+
+        Returns
+        -------
+        T
+            Result of the first request to succeed.
+        """
+        return self.call_with_request_count(function, *args, **kwargs)[0]
+
+    def call_with_request_count(
+        self, function: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> Tuple[T, int]:
+        """
+        Call a function of the backend, and count the requests sent.
+
+        Args
+        ----
+        function (Callable[..., T]): Function sending the request.
+        args (Any): Positional arguments of the function.
+        kwargs (Any): Keyword arguments of the function.
+
+        Returns
+        -------
+        Tuple[T, int]
+            Result of the first request to succeed, and the number of
+            requests sent (including the duplicate requests).
+
+        Raises
+        ------
+        CircuitOpen
+            If the backend is failing and was not called.
+        CallTimeout
+            If no request succeeded before the deadline.
+        Exception
+            Error of the last request to fail, if all of them failed.
+        """
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.before_call()
+
+        start_time = time.monotonic()
+        deadline = None if self.timeout is None else start_time + self.timeout
+        hedge_delay = self._hedge_delay()
+        hedges_left = self.max_hedges if hedge_delay is not None else 0
+        next_hedge_time = (
+            None if hedge_delay is None else start_time + hedge_delay
+        )
+
+        pending: Set[Future] = {
+            self._executor.submit(function, *args, **kwargs)
+        }
+        number_of_requests = 1
+        while True:
+            wait_until = min(
+                (
+                    moment
+                    for moment in (
+                        deadline,
+                        next_hedge_time if hedges_left else None,
+                    )
+                    if moment is not None
+                ),
+                default=None,
+            )
+            done, pending = wait(
+                pending,
+                timeout=(
+                    None
+                    if wait_until is None
+                    else max(wait_until - time.monotonic(), 0.0)
+                ),
+                return_when=FIRST_COMPLETED,
+            )
+
+            error: Optional[BaseException] = None
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    # the first response wins, the other requests are left
+                    # to finish in the background
+                    self.latency_tracker.record(time.monotonic() - start_time)
+                    if self.circuit_breaker is not None:
+                        self.circuit_breaker.record_success()
+                    return future.result(), number_of_requests
+
+            now = time.monotonic()
+            if error is not None and not pending and not hedges_left:
+                self._record_failure()
+                raise error
+            if deadline is not None and now >= deadline:
+                self._record_failure()
+                raise CallTimeout(
+                    f"no response after {self.timeout:.0f} seconds"
+                )
+            if hedges_left and (
+                not pending
+                or (next_hedge_time is not None and now >= next_hedge_time)
+            ):
+                pending.add(self._executor.submit(function, *args, **kwargs))
+                number_of_requests += 1
+                self.number_of_hedges += 1
+                hedges_left -= 1
+                next_hedge_time = now + (hedge_delay or 0.0)
+
+    def stream(
+        self, function: Callable[..., Iterable[T]], *args: Any, **kwargs: Any
+    ) -> Iterator[T]:
+        """
+        Call a function of the backend returning a stream.
+
+        Opening the stream and receiving its first item go through the
+        circuit breaker and must happen before the deadline; the following
+        items are received without a deadline. Streams are not hedged.
+
+        Args
+        ----
+        function (Callable[..., Iterable[T]]): Function opening the stream.
+        args (Any): Positional arguments of the function.
+        kwargs (Any): Keyword arguments of the function.
+
+        Returns
+        -------
+        Iterator[T]
+            Items of the stream.
+
+        Raises
+        ------
+        CircuitOpen
+            If the backend is failing and was not called.
+        CallTimeout
+            If the first item was not received before the deadline.
+        Exception
+            Error raised while opening the stream or receiving an item.
+        """
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.before_call()
+
+        def open_stream() -> Tuple[Iterator[T], List[T]]:
+            items = iter(function(*args, **kwargs))
+            return items, list(itertools.islice(items, 1))
+
+        future = self._executor.submit(open_stream)
+        done, _ = wait({future}, timeout=self.timeout)
+        if not done:
+            # the stream is abandoned, like the requests past their deadline
+            self._record_failure()
+            raise CallTimeout(
+                f"no response after {self.timeout:.0f} seconds"
+            )
+        error = future.exception()
+        if error is not None:
+            self._record_failure()
+            raise error
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_success()
+
+        items, first_items = future.result()
+        yield from first_items
+        yield from items
+
+    def _record_failure(self) -> None:
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_failure()
+
+
+_caller_settings: Dict[str, Dict[str, Any]] = {}
+_circuit_breakers: Dict[str, Optional[CircuitBreaker]] = {}
+_callers: Dict[Tuple[str, Optional[str]], ResilientCaller] = {}
+
+
+def configure_backend(
+    backend: str,
+    *,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+    **settings: Any,
+) -> None:
+    """
+    Configure the callers of a backend.
+
+    Args
+    ----
+    backend (str): Name of the backend (for example, `LLM_CALLS`).
+    circuit_breaker (Optional[CircuitBreaker]): Circuit breaker shared by\
+        the callers of the backend. If None, the backend is always called.
+    settings (Any): Other keyword arguments of `ResilientCaller`.
+    """
+    _caller_settings[backend] = settings
+    _circuit_breakers[backend] = circuit_breaker
+    for key in [key for key in _callers if key[0] == backend]:
+        del _callers[key]
+
+
+def get_caller(backend: str, stage: Optional[str] = None) -> ResilientCaller:
+    """
+    Get the caller of a backend for a stage, creating it if needed.
+
+    The latencies are tracked per stage, since the prompts and responses of
+    the stages have very different lengths: the short calls of one stage
+    would otherwise set the hedge delay of the long calls of another. The
+    callers of a backend share its circuit breaker, which is created with
+    the defaults if the backend was not configured.
+
+    Args
+    ----
+    backend (str): Name of the backend (for example, `LLM_CALLS`).
+    stage (Optional[str]): Name of the stage making the calls.
+
+    Returns
+    -------
+    ResilientCaller
+        Caller of the backend for the stage.
+    """
+    key = (backend, stage)
+    if key not in _callers:
+        if backend not in _circuit_breakers:
+            _circuit_breakers[backend] = CircuitBreaker()
+        _callers[key] = ResilientCaller(
+            circuit_breaker=_circuit_breakers[backend],
+            **_caller_settings.get(backend, {}),
+        )
+    return _callers[key]
@@ -1,52 +1,243 @@
-import re
-from typing import List, Optional
+import json
+import os
+import stat
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
-import nltk
-from nltk.tokenize import sent_tokenize
+OUTPUT_FORMATS = ("json", "compact-json", "jsonl")
 
-from utils import remove_markdown
 
+def _get_file_mode(file_path: str) -> int:
+    # the mode of the file being replaced, or the default mode of a new file
+    try:
+        return stat.S_IMODE(os.stat(file_path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
 
-def extract_questions(llm_response: str, negative_response: str) -> List[str]:
+
+def _write_atomically(file_path: str, lines: Iterable[str]) -> None:
+    # write to a temporary file in the same directory and rename it, so the
+    # file is either the previous one or the complete new one
+    directory = os.path.dirname(os.path.abspath(file_path))
+    file_descriptor, temporary_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(file_path)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        # the temporary file is only readable by its owner
+        os.chmod(temporary_path, _get_file_mode(file_path))
+        os.replace(temporary_path, file_path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def iter_exported_questions(file_path: str) -> Iterator[Dict[str, Any]]:
     """
-    Extract questions from the LLM response.
+    Read the questions exported to a JSON Lines file one by one.
 
     Args
     ----
-    llm_response (str): LLM response.
-    negative_response (str): Text to
-        check if the response is negative.
+    file_path (str): Path of the JSON Lines file, either the output of the\
+        'jsonl' format or the partial file of an unfinished export.
 
     Returns
     -------
-    List[str]
-        List of questions extracted from the LLM response.
+    Iterator[Dict[str, Any]]
+        Records with the 'topic', 'question', 'answers' and 'correct_answer'
+        of each question.
     """
-    # check if the response is negative
-    if negative_response.lower() in llm_response.lower():
-        return []
+    with open(file_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
 
-    llm_response_no_markdown = remove_markdown(llm_response)
 
-    # remove newlines
-    llm_response_no_boiler_plate = llm_response_no_markdown.replace(
-        ":\n\n", ".\n"
-    )
+def _recover_partial_questions(file_path: str) -> List[Dict[str, Any]]:
+    # the last line of the partial file of a crashed run may be incomplete
+    records = []
+    try:
+        with open(file_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return records
 
-    # remove "(...)" at the end of lines
-    llm_response_no_references = re.sub(
-        r"\(.*\) *\n+", "", llm_response_no_boiler_plate
-    )
 
-    nltk.download("punkt", quiet=True, force=False, raise_on_error=True)
+def get_partial_file_path(file_path: str) -> str:
+    return f"{file_path}.partial"
+
+
+def load_exported_questions(
+    file_path: str, output_format: str = "json"
+) -> List[Dict[str, Any]]:
+    """
+    Read the questions of a finished export.
+
+    Args
+    ----
+    file_path (str): Path of the output file.
+    output_format (str): Format of the output file (see `QuestionExporter`).
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        Records with the 'topic', 'question', 'answers' and 'correct_answer'
+        of each question, empty if the file does not exist.
+    """
+    if not os.path.exists(file_path):
+        return []
+    if output_format == "jsonl":
+        return list(iter_exported_questions(file_path))
 
+    with open(file_path, encoding="utf-8") as f:
+        grouped = json.load(f)
     return [
-        sentence
-        for sentence in sent_tokenize(llm_response_no_references)
-        if sentence.endswith("?")
+        {"topic": group["topic"], **record}
+        for group in grouped
+        for record in group["questions"]
     ]
 
 
+class QuestionExporter:
+    """
+    Export the questions and answers as soon as each of them is finished.
+
+    Each question is appended to the partial file `<file_path>.partial` as a
+    JSON Lines record, so the finished questions are kept even if the run
+    crashes. When resuming, the questions of the partial file left by an
+    interrupted run are recovered (see `recovered_questions`) and exported
+    again, otherwise the partial file is overwritten. Closing the exporter
+    writes the final file atomically and removes the partial file; the file
+    at `file_path` is not modified until then.
+
+    Args
+    ----
+    file_path (str): Path of the output file.
+    output_format (str): 'json' (indented, grouped by topic),\
+        'compact-json' (grouped by topic, without whitespace) or 'jsonl'\
+        (one question per line).
+    resume (bool): Whether to recover the questions of the partial file\
+        left by an interrupted run.
+    """
+
+    def __init__(
+        self,
+        file_path: str = "questions_and_answers.json",
+        *,
+        output_format: str = "json",
+        resume: bool = False,
+    ) -> None:
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(
+                f"Unknown output format {output_format!r}, "
+                f"expected one of {OUTPUT_FORMATS}"
+            )
+        self.file_path = file_path
+        self.output_format = output_format
+        self.partial_file_path = get_partial_file_path(file_path)
+        self.recovered_questions = (
+            _recover_partial_questions(self.partial_file_path)
+            if resume
+            else []
+        )
+        self.number_of_questions = len(self.recovered_questions)
+        # written again without the incomplete line of a crashed run
+        self._partial_file = open(
+            self.partial_file_path, "w", encoding="utf-8"
+        )
+        for record in self.recovered_questions:
+            self._partial_file.write(json.dumps(record) + "\n")
+        self._partial_file.flush()
+
+    def __enter__(self) -> "QuestionExporter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # keep the partial file with the finished questions
+            self._partial_file.close()
+
+    def add(
+        self,
+        topic: str,
+        question: str,
+        answers: List[str],
+        correct_answer: Optional[str],
+    ) -> None:
+        """
+        Export a question, unless it has no answers or no correct answer.
+
+        Args
+        ----
+        topic (str): Topic of the question.
+        question (str): Question.
+        answers (List[str]): Multiple choice answers.
+        correct_answer (Optional[str]): Correct answer.
+        """
+        if not answers or correct_answer is None:
+            return
+
+        # the topic is stripped when writing the final file, so the topics
+        # differing only by whitespace are still grouped separately
+        record = {
+            "topic": topic,
+            "question": question.strip(),
+            "answers": answers,
+            "correct_answer": correct_answer.strip(),
+        }
+        self._partial_file.write(json.dumps(record) + "\n")
+        self._partial_file.flush()
+        self.number_of_questions += 1
+
+    def close(self) -> None:
+        """
+        Write the final file and remove the partial file.
+        """
+        if self._partial_file.closed:
+            return
+        self._partial_file.close()
+
+        records = iter_exported_questions(self.partial_file_path)
+        if self.output_format == "jsonl":
+            _write_atomically(
+                self.file_path,
+                (
+                    json.dumps({**record, "topic": record["topic"].strip()})
+                    + "\n"
+                    for record in records
+                ),
+            )
+        else:
+            # group the questions by topic, keeping the order of the topics
+            data: Dict[str, List[Dict[str, Any]]] = {}
+            for record in records:
+                data.setdefault(record.pop("topic"), []).append(record)
+            grouped = [
+                {"topic": topic.strip(), "questions": questions}
+                for topic, questions in data.items()
+            ]
+
+            if self.output_format == "compact-json":
+                text = json.dumps(grouped, separators=(",", ":"))
+            else:
+                text = json.dumps(grouped, indent=4)
+            _write_atomically(self.file_path, [text])
+
+        os.remove(self.partial_file_path)
+
+
 def export_questions_and_answers(
     guessed_topics: List[str],
     questions: List[List[str]],
@@ -54,6 +245,7 @@ def export_questions_and_answers(
     correct_answers: List[List[Optional[str]]],
     *,
     file_path: str = "questions_and_answers.json",
+    output_format: str = "json",
 ) -> None:
     """
     Export the questions and answers to a json file.
@@ -65,73 +257,16 @@ def export_questions_and_answers(
     answers (List[List[List[str]]): List of answers.
     correct_answers (List[List[Optional[str]]]): List of correct answers.
     file_path (str): File path.
+    output_format (str): 'json', 'compact-json' or 'jsonl'\
+        (see `QuestionExporter`).
     """
-    import json
-
-    data = []
-    for topic, question_list, answer_list, correct_answer_list in zip(
-        guessed_topics, questions, answers, correct_answers
-    ):
-        if not question_list:
-            continue
-
-        data.append(
-            {
-                "topic": topic.strip(),
-                "questions": [
-                    {
-                        "question": question.strip(),
-                        "answers": answers_to_question,
-                        "correct_answer": correct_answer.strip(),
-                    }
-                    for question, answers_to_question, correct_answer in zip(
-                        question_list, answer_list, correct_answer_list
-                    )
-                    if answers_to_question and correct_answer is not None
-                ],
-            }
-        )
-
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4)
-
-
-def extract_answers(
-    llm_response: str,
-    *,
-    negative_response: str,
-    max_number_of_answers,
-) -> List[str]:
-    """
-    Extract answers from the LLM response.
-
-    Args
-    ----
-    llm_response (str): LLM response.
-    negative_response (str): Text to\
-        check if the response is negative.
-    max_number_of_answers (int): Maximum number of answers.
-    verbose (bool, optional):\
-        Whether to print the extracted answers.\
-        By default False.
-
-    Returns
-    -------
-    List[str]
-        List of answers extracted from the LLM response.
-    """
-    # check if the response is negative
-    if negative_response.lower() in llm_response.lower():
-        return []
-
-    llm_response_no_markdown = remove_markdown(llm_response)
-
-    answers = [
-        sentence.strip()
-        for sentence in llm_response_no_markdown.split("\n")
-        # add sentence if it starts with a letter and parantheses
-        if re.match(r"^\s*[a-zA-Z]\s*\)", sentence)
-    ]
-
-    # return the first max_number_of_answers answers
-    return answers[: min(max_number_of_answers, len(answers))]
+    with QuestionExporter(file_path, output_format=output_format) as exporter:
+        for topic, question_list, answer_list, correct_answer_list in zip(
+            guessed_topics, questions, answers, correct_answers
+        ):
+            for question, answers_to_question, correct_answer in zip(
+                question_list, answer_list, correct_answer_list
+            ):
+                exporter.add(
+                    topic, question, answers_to_question, correct_answer
+                )
@@ -1,13 +1,16 @@
 import re
 from collections import Counter
 from itertools import chain
-from typing import List, Tuple
+from typing import Dict, List, NamedTuple, Tuple
 
 import gensim
 import spacy
 from gensim.corpora import Dictionary
 from gensim.models import CoherenceModel, LdaModel
+from gensim.parsing.porter import PorterStemmer
 from gensim.parsing.preprocessing import preprocess_documents
+from gensim.utils import tokenize
+from langchain_core.documents.base import Document
 
 
 def prepare_corpus(
@@ -33,15 +36,42 @@ def prepare_corpus(
     dictionary = Dictionary(texts)
     corpus = [dictionary.doc2bow(text) for text in texts]
 
-    return corpus, dictionary, texts
+    return corpus, dictionary, texts, bigram
 
 
-def extract_topics_in_weighted_phrases(
+class LdaTopics(NamedTuple):
+    """
+    Topics extracted from a list of documents.
+
+    Args
+    ----
+    weighted_phrases (List[str]): Each topic, represented as weighted\
+        phrases.
+    document_topics (List[List[Tuple[int, float]]]): Topic distribution of\
+        each document, as (topic index, probability) pairs.
+    lda_model (LdaModel): Trained LDA model.
+    dictionary (Dictionary): Dictionary of the corpus.
+    bigram (gensim.models.Phrases): Bigram model of the corpus.
+    coherence (float): Coherence score of the topics.
+    topic_coherences (List[float]): Coherence score of each topic.
+    """
+
+    weighted_phrases: List[str]
+    document_topics: List[List[Tuple[int, float]]]
+    lda_model: LdaModel
+    dictionary: Dictionary
+    bigram: gensim.models.Phrases
+    coherence: float
+    topic_coherences: List[float]
+
+
+def extract_topics(
     documents: List[str],
     *,
     number_of_topics: int = 10,
-    passes_over_corpus: int = 5
-) -> List[str]:
+    passes_over_corpus: int = 5,
+    min_topic_probability: float = 0.2,
+) -> LdaTopics:
     """
     Extract topics from a list of documents using LDA.
 
@@ -53,13 +83,16 @@ def extract_topics_in_weighted_phrases(
         Number of topics to extract, by default 10
     passes_over_corpus : int, optional
         Number of passes over the corpus, by default 5
+    min_topic_probability : float, optional
+        Topics with a lower probability are left out of the topic\
+        distribution of a document, by default 0.2
 
     Returns
     -------
-    List[str]
-        List of topics, represented as weighted phrases.
+    LdaTopics
+        Topics, topic distribution of each document and the trained models.
     """
-    corpus, dictionary, texts = prepare_corpus(documents)
+    corpus, dictionary, texts, bigram = prepare_corpus(documents)
 
     lda_model = LdaModel(
         corpus,
@@ -72,16 +105,235 @@ def extract_topics_in_weighted_phrases(
     coherence_model_lda = CoherenceModel(
         model=lda_model, texts=texts, dictionary=dictionary, coherence="c_v"
     )
-    coherence_lda = coherence_model_lda.get_coherence()
+    topic_coherences = coherence_model_lda.get_coherence_per_topic()
+    coherence_lda = coherence_model_lda.aggregate_measures(topic_coherences)
     print(
         "\nFinished training LDA model with coherence score: ", coherence_lda
     )
 
-    topics = lda_model.print_topics(num_words=10)
+    topics = lda_model.print_topics(num_topics=number_of_topics, num_words=10)
 
     weighted_phrases = [topic[1] for topic in topics]
 
-    return weighted_phrases
+    document_topics = [
+        lda_model.get_document_topics(
+            bow, minimum_probability=min_topic_probability
+        )
+        for bow in corpus
+    ]
+
+    return LdaTopics(
+        weighted_phrases,
+        document_topics,
+        lda_model,
+        dictionary,
+        bigram,
+        coherence_lda,
+        topic_coherences,
+    )
+
+
+def infer_document_topics(
+    lda_topics: LdaTopics,
+    documents: List[str],
+    *,
+    min_topic_probability: float = 0.2,
+) -> List[List[Tuple[int, float]]]:
+    """
+    Get the topic distribution of new documents with the trained models.
+
+    The topics themselves are not updated, so their names stay valid. The
+    words missing from the dictionary of the corpus are ignored, and the
+    documents without known words get no topics.
+
+    Args
+    ----
+    lda_topics (LdaTopics): Topics extracted from the corpus.
+    documents (List[str]): New documents.
+    min_topic_probability (float): Topics with a lower probability are\
+        left out of the topic distribution of a document.
+
+    Returns
+    -------
+    List[List[Tuple[int, float]]]
+        Topic distribution of each document, as (topic index, probability)
+        pairs.
+    """
+    document_topics = []
+    for text in preprocess_documents(documents):
+        bow = lda_topics.dictionary.doc2bow(lda_topics.bigram[text])
+        # without known words the distribution is uniform, not informative
+        document_topics.append(
+            lda_topics.lda_model.get_document_topics(
+                bow, minimum_probability=min_topic_probability
+            )
+            if bow
+            else []
+        )
+    return document_topics
+
+
+TOPIC_LABELERS = ("llm", "local")
+
+
+def _get_surface_forms(documents: List[str]) -> Dict[str, str]:
+    # the corpus is stemmed, so each stem is shown as its most frequent word
+    stemmer = PorterStemmer()
+    words_by_stem: Dict[str, Counter] = {}
+    for document in documents:
+        for word in tokenize(document, lower=True):
+            stem = stemmer.stem(word)
+            words_by_stem.setdefault(stem, Counter())[word] += 1
+    return {
+        stem: words.most_common(1)[0][0]
+        for stem, words in words_by_stem.items()
+    }
+
+
+def get_local_topic_labels(
+    lda_topics: LdaTopics,
+    documents: List[str],
+    *,
+    number_of_phrases: int = 2,
+    number_of_terms: int = 10,
+) -> List[str]:
+    """
+    Label the topics with their top weighted phrases, without an LLM.
+
+    The bigrams of the top terms of a topic are preferred over single
+    words. A phrase leading the label of an earlier topic is not reused to
+    lead another label, and the topics that still get the same label are
+    told apart by their number.
+
+    Args
+    ----
+    lda_topics (LdaTopics): Extracted topics.
+    documents (List[str]): Documents the topics were extracted from, to\
+        show the stemmed terms as words.
+    number_of_phrases (int): Number of phrases in a label.
+    number_of_terms (int): Number of top terms of a topic to pick the\
+        phrases from.
+
+    Returns
+    -------
+    List[str]
+        Label of each topic (for example, 'Page table, virtual memory').
+    """
+    surface_forms = _get_surface_forms(documents)
+    delimiter = lda_topics.bigram.delimiter
+    if isinstance(delimiter, bytes):
+        delimiter = delimiter.decode()
+
+    def readable(term: str) -> str:
+        return " ".join(
+            surface_forms.get(word, word) for word in term.split(delimiter)
+        )
+
+    labels: List[str] = []
+    leading_phrases = set()
+    for topic_index in range(len(lda_topics.weighted_phrases)):
+        terms = [
+            lda_topics.dictionary[word_id]
+            for word_id, _ in lda_topics.lda_model.get_topic_terms(
+                topic_index, topn=number_of_terms
+            )
+        ]
+        # bigrams first, each group in the order of weight
+        phrases = [readable(term) for term in terms if delimiter in term]
+        phrases += [readable(term) for term in terms if delimiter not in term]
+        phrases = list(dict.fromkeys(phrases))
+
+        leading = [
+            phrase for phrase in phrases if phrase not in leading_phrases
+        ]
+        chosen = (leading or phrases)[:1]
+        chosen += [phrase for phrase in phrases if phrase not in chosen][
+            : number_of_phrases - 1
+        ]
+        if chosen:
+            leading_phrases.add(chosen[0])
+            label = ", ".join(chosen)
+            label = label[0].upper() + label[1:]
+        else:
+            label = f"Topic {topic_index + 1}"
+        if label in labels:
+            label = f"{label} ({topic_index + 1})"
+        labels.append(label)
+    return labels
+
+
+TOPIC_PRIORITIES = ("weight", "coherence", "none")
+
+
+def rank_topics(lda_topics: LdaTopics, *, by: str = "weight") -> List[int]:
+    """
+    Order the topics by priority.
+
+    Args
+    ----
+    lda_topics (LdaTopics): Extracted topics.
+    by (str): 'weight' ranks the topics by their total probability over the\
+        documents (the topics covering more of the slides first),\
+        'coherence' by their coherence score, and 'none' keeps the order\
+        of the LDA model.
+
+    Returns
+    -------
+    List[int]
+        Indices of the topics, from the highest priority to the lowest.
+    """
+    topic_indices = list(range(len(lda_topics.weighted_phrases)))
+    if by == "none":
+        return topic_indices
+    if by == "coherence":
+        scores = list(lda_topics.topic_coherences)
+    elif by == "weight":
+        scores = [0.0] * len(topic_indices)
+        for topics in lda_topics.document_topics:
+            for topic_index, probability in topics:
+                scores[topic_index] += probability
+    else:
+        raise ValueError(f"Unknown topic priority: {by}")
+    # sorted is stable, so ties keep the order of the LDA model
+    return sorted(topic_indices, key=lambda i: -scores[i])
+
+
+def get_topic_metadata_key(topic_index: int) -> str:
+    return f"topic_{topic_index}"
+
+
+def assign_topics_to_documents(
+    documents: List[Document],
+    document_topics: List[List[Tuple[int, float]]],
+) -> List[Document]:
+    """
+    Mark each document with the topics it belongs to.
+
+    Args
+    ----
+    documents (List[Document]): Documents the topics were extracted from.
+    document_topics (List[List[Tuple[int, float]]]): Topic distribution of\
+        each document.
+
+    Returns
+    -------
+    List[Document]
+        Documents whose metadata has the key `get_topic_metadata_key(i)` set
+        to True for each topic `i` in their topic distribution.
+    """
+    return [
+        Document(
+            page_content=document.page_content,
+            metadata={
+                **document.metadata,
+                **{
+                    get_topic_metadata_key(topic_index): True
+                    for topic_index, _ in topics
+                },
+            },
+        )
+        for document, topics in zip(documents, document_topics)
+    ]
 
 
 def preprocess_documents_with_spacy(documents, banned_chars):
@@ -1,18 +1,26 @@
 import functools
+import time
+from collections import defaultdict
 from textwrap import dedent
-from typing import Generator, List, Optional
+from typing import Dict, Generator, List, Optional
 
 import google.generativeai as genai
 from deep_translator import GoogleTranslator
-
-# import googletrans  # type: ignore
+from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable
 from langchain_core.documents.base import Document
 from tqdm import tqdm
 
+from budget import charge_llm_call, check_budget
+from language_detection import detect_language
+from models import DEFAULT_LLM_MODEL, TOPICS, ModelConfig
+from resilience import LLM_CALLS, get_caller
+
 
 @functools.lru_cache
 def get_google_ai_model(
     max_output_tokens: Optional[int] = None,
+    model_name: str = DEFAULT_LLM_MODEL,
+    temperature: Optional[float] = None,
 ) -> genai.GenerativeModel:
     """
     Get the Google AI model.
@@ -23,6 +31,11 @@ def get_google_ai_model(
         Maximum number of tokens to generate.\
         If None, the default maximum number of tokens is used.\
         By default None.
+    model_name (str, optional):\
+        Name of the model, by default 'gemini-1.5-flash-latest'.
+    temperature (Optional[float], optional):\
+        Sampling temperature. If None, the default temperature is used.\
+        By default None.
 
     Returns
     -------
@@ -32,32 +45,58 @@ def get_google_ai_model(
 
     generation_config = genai.GenerationConfig(
         max_output_tokens=max_output_tokens,
+        temperature=temperature,
     )
     return genai.GenerativeModel(
-        "gemini-1.5-flash-latest",
+        model_name,
         generation_config=generation_config,
     )
 
 
-def remove_markdown(text: str) -> str:
+def generate_content(
+    prompt: str,
+    model_config: ModelConfig = ModelConfig(),
+    *,
+    stage: Optional[str] = None,
+) -> str:
     """
-    Remove markdown from text.
+    Generate text with the configured Google AI model, retrying the failed
+    requests with exponential backoff.
 
     Args
     ----
-    text (str): Text with markdown.
+    prompt (str): Prompt.
+    model_config (ModelConfig, optional):\
+        Configuration of the model, by default the default model.
+    stage (Optional[str]): Stage generating the text, whose calls are\
+        tracked together.
 
     Returns
     -------
     str
-        Text without markdown.
+        Generated text.
     """
-
-    from bs4 import BeautifulSoup
-    from markdown import markdown
-
-    html = markdown(text)
-    return "".join(BeautifulSoup(html, "html.parser").findAll(string=True))
+    model = get_google_ai_model(
+        model_config.max_output_tokens,
+        model_config.model,
+        model_config.temperature,
+    )
+    retry = 0
+    while True:
+        try:
+            check_budget()
+            text, number_of_requests = get_caller(
+                LLM_CALLS, stage
+            ).call_with_request_count(
+                lambda: model.generate_content(prompt).text
+            )
+            charge_llm_call(prompt, text, requests=number_of_requests)
+            return text
+        except (ResourceExhausted, ServiceUnavailable):
+            if retry >= model_config.max_retries:
+                raise
+            time.sleep(2**retry)
+            retry += 1
 
 
 def get_page_contents(documents: List[Document]) -> Generator[str, None, None]:
@@ -77,7 +116,9 @@ def get_page_contents(documents: List[Document]) -> Generator[str, None, None]:
 
 
 def guess_topic_from_weighted_phrases(
-    weighted_phrases: str, excluded_topics: List[str] = list()
+    weighted_phrases: str,
+    excluded_topics: List[str] = list(),
+    model_config: ModelConfig = ModelConfig(max_output_tokens=5),
 ) -> str:
     """
     Guess the topic from the weighted phrases.
@@ -89,6 +130,9 @@ def guess_topic_from_weighted_phrases(
         Excluded topics. This is useful when the topic is\
         already known and should be excluded from the guesses,\
         by default [].
+    model_config (ModelConfig, optional):\
+        Configuration of the model guessing the topic,\
+        by default the default model with 5 output tokens.
 
     Returns
     -------
@@ -96,7 +140,6 @@ def guess_topic_from_weighted_phrases(
         Guessed topic.
     """
     # Guess the topic from the weighted phrases using the Google AI model
-    model = get_google_ai_model(max_output_tokens=5)
     excluded_topics = [topic.lower() for topic in excluded_topics]
     exclude_previous_topics_message = (
         "Don't include these in your guess:\n\n"
@@ -119,17 +162,7 @@ def guess_topic_from_weighted_phrases(
         Topic:"""
     )
 
-    response = model.generate_content(prompt)
-
-    return response.text
-
-
-def detect_language(text: str) -> str:
-    translator = googletrans.Translator()
-    language = translator.translate(text[: min(1000, len(text))]).src
-
-    # map language code to full name
-    return googletrans.LANGUAGES[language]
+    return generate_content(prompt, model_config, stage=TOPICS)
 
 
 def translate_page_contents(page_contents, source_language):
@@ -145,3 +178,53 @@ def translate_page_contents(page_contents, source_language):
     ]
     page_contents = translated_docs
     return page_contents
+
+
+def translate_non_english_page_contents(
+    page_contents: List[str], *, verbose: bool = False
+) -> List[str]:
+    """
+    Translate the pages that are not in English to English.
+
+    The language of each page is detected locally, so only the pages in
+    another language are sent to the translator.
+
+    Args
+    ----
+    page_contents (List[str]): Content of each page.
+    verbose (bool, optional):\
+        Whether to print the number of pages in each language.\
+        By default False.
+
+    Returns
+    -------
+    List[str]
+        Content of each page, in English.
+    """
+    pages_by_language: Dict[str, List[int]] = defaultdict(list)
+    for i, page_content in enumerate(page_contents):
+        language = detect_language(page_content)
+        # pages too short to be identified are left as they are
+        if language is not None:
+            pages_by_language[language].append(i)
+
+    if verbose:
+        print(
+            "Pages by language: "
+            + ", ".join(
+                f"{language}: {len(pages)}"
+                for language, pages in pages_by_language.items()
+            )
+        )
+
+    translated_page_contents = list(page_contents)
+    for language, pages in pages_by_language.items():
+        if language == "english":
+            continue
+        translated_pages = translate_page_contents(
+            [page_contents[i] for i in pages], language
+        )
+        for i, translated_page in zip(pages, translated_pages):
+            translated_page_contents[i] = translated_page
+
+    return translated_page_contents
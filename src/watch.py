@@ -0,0 +1,288 @@
+"""
+Incremental maintenance of the question bank of a directory of PDF files.
+
+The directory is polled, and each file is identified by the hash of its
+content (only computed again when its modification time or size changed), so
+only the added, modified and removed files are processed: their
+chunks are replaced in the vector store, their pages are assigned to the
+existing topics, and only the questions of the topics whose pages changed are
+generated again.
+"""
+
+import copy
+import hashlib
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from langchain_community.vectorstores.chroma import Chroma
+from langchain_core.documents.base import Document
+
+from ocr import list_pdf_files
+from rag import update_vector_store
+from topic_extraction import LdaTopics, assign_topics_to_documents
+
+
+def hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileState(NamedTuple):
+    """
+    State of a file in a snapshot.
+
+    Args
+    ----
+    modification_time (int): Modification time, in nanoseconds.
+    size (int): Size in bytes.
+    digest (str): Hash of the content.
+    """
+
+    modification_time: int
+    size: int
+    digest: str
+
+
+def snapshot_pdf_files(
+    pdf_directory: str,
+    previous_snapshot: Optional[Dict[str, FileState]] = None,
+) -> Dict[str, FileState]:
+    """
+    Hash the PDF files in a directory.
+
+    The files whose modification time and size are the same as in the
+    previous snapshot are not hashed again.
+
+    Args
+    ----
+    pdf_directory (str): Directory containing the PDF files.
+    previous_snapshot (Optional[Dict[str, FileState]]): Previous snapshot\
+        of the directory.
+
+    Returns
+    -------
+    Dict[str, FileState]
+        State of each PDF file, by path.
+    """
+    previous_snapshot = previous_snapshot or {}
+    snapshot = {}
+    for file_path in list_pdf_files(pdf_directory):
+        try:
+            stat = os.stat(file_path)
+            previous_state = previous_snapshot.get(file_path)
+            if previous_state is not None and (
+                previous_state.modification_time,
+                previous_state.size,
+            ) == (stat.st_mtime_ns, stat.st_size):
+                snapshot[file_path] = previous_state
+                continue
+            snapshot[file_path] = FileState(
+                stat.st_mtime_ns, stat.st_size, hash_file(file_path)
+            )
+        except OSError:
+            # removed while listing the directory
+            continue
+    return snapshot
+
+
+class FileChanges(NamedTuple):
+    """
+    Changes between two snapshots of a directory.
+
+    Args
+    ----
+    added (List[str]): New files.
+    modified (List[str]): Files whose content changed.
+    removed (List[str]): Files that no longer exist.
+    """
+
+    added: List[str]
+    modified: List[str]
+    removed: List[str]
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.modified or self.removed)
+
+
+def get_file_changes(
+    old_snapshot: Dict[str, FileState], new_snapshot: Dict[str, FileState]
+) -> FileChanges:
+    # a file whose modification time changed but not its content (for
+    # example, copied again) is not modified
+    return FileChanges(
+        added=sorted(set(new_snapshot) - set(old_snapshot)),
+        modified=sorted(
+            file_path
+            for file_path in set(new_snapshot) & set(old_snapshot)
+            if new_snapshot[file_path].digest
+            != old_snapshot[file_path].digest
+        ),
+        removed=sorted(set(old_snapshot) - set(new_snapshot)),
+    )
+
+
+def wait_for_file_changes(
+    pdf_directory: str,
+    snapshot: Dict[str, FileState],
+    *,
+    interval: float = 10.0,
+) -> Tuple[FileChanges, Dict[str, FileState]]:
+    """
+    Poll a directory until its PDF files differ from a snapshot.
+
+    The changes are only reported once the directory stayed the same for a
+    whole interval, so a file being copied is not processed half-written.
+    Only the files whose modification time or size changed since the
+    previous poll are hashed.
+
+    Args
+    ----
+    pdf_directory (str): Directory containing the PDF files.
+    snapshot (Dict[str, FileState]): Snapshot of the files already\
+        processed. The caller only replaces it once the changes are\
+        processed, so the changes of a failed update are reported again.
+    interval (float): Seconds between two polls.
+
+    Returns
+    -------
+    Tuple[FileChanges, Dict[str, FileState]]
+        Changes since the snapshot, and the new snapshot.
+    """
+    previous_poll: Optional[Dict[str, FileState]] = None
+    while True:
+        time.sleep(interval)
+        current_poll = snapshot_pdf_files(
+            pdf_directory,
+            snapshot if previous_poll is None else previous_poll,
+        )
+        if current_poll != previous_poll:
+            previous_poll = current_poll
+            continue
+        changes = get_file_changes(snapshot, current_poll)
+        if changes:
+            return changes, current_poll
+        # the snapshot also follows the files whose content is the same
+        snapshot = current_poll
+        previous_poll = None
+
+
+class QuestionBank:
+    """
+    Pages, topics and vector store of a directory, kept up to date with the
+    changes of its files.
+
+    Args
+    ----
+    documents (List[Document]): Pages of the files.
+    document_topics (List[List[Tuple[int, float]]]): Topic distribution of\
+        each page.
+    lda_topics (LdaTopics): Topics of the pages.
+    vector_store (Chroma): Vector store of the chunks of the pages.
+    topic_filter (bool): Whether the pages are marked with their topics in\
+        the vector store (see `assign_topics_to_documents`).
+    """
+
+    def __init__(
+        self,
+        documents: List[Document],
+        document_topics: List[List[Tuple[int, float]]],
+        lda_topics: LdaTopics,
+        vector_store: Chroma,
+        *,
+        topic_filter: bool = True,
+    ) -> None:
+        self.lda_topics = lda_topics
+        self.vector_store = vector_store
+        self.topic_filter = topic_filter
+        self.page_topics: Dict[str, List[Set[int]]] = {}
+        self._add_pages(documents, document_topics)
+
+    def _add_pages(
+        self,
+        documents: List[Document],
+        document_topics: List[List[Tuple[int, float]]],
+    ) -> None:
+        for document, topics in zip(documents, document_topics):
+            source = document.metadata.get("source", "")
+            self.page_topics.setdefault(source, []).append(
+                {topic_index for topic_index, _ in topics}
+            )
+
+    def get_source_topics(self, source: str) -> Set[int]:
+        return set().union(*self.page_topics.get(source, []))
+
+    def get_topics_with_pages(self) -> Set[int]:
+        return set().union(
+            *(self.get_source_topics(source) for source in self.page_topics)
+        )
+
+    def get_topic_indices(self) -> List[Optional[int]]:
+        """
+        Get the topic index used to filter the retrieval for each topic.
+
+        Returns
+        -------
+        List[Optional[int]]
+            Index of each topic, or None for the topics without pages.
+        """
+        topics_with_pages = self.get_topics_with_pages()
+        return [
+            topic_index if topic_index in topics_with_pages else None
+            for topic_index in range(len(self.lda_topics.weighted_phrases))
+        ]
+
+    def apply_changes(
+        self,
+        changes: FileChanges,
+        documents: List[Document],
+        document_topics: List[List[Tuple[int, float]]],
+    ) -> Tuple["QuestionBank", Set[int]]:
+        """
+        Replace the chunks of the changed files in the vector store, and get
+        the question bank with their new pages.
+
+        The question bank itself is not modified, so it is only replaced by
+        the updated one once the questions of the changed topics are
+        generated, and a failed update can be applied again.
+
+        Args
+        ----
+        changes (FileChanges): Changed files.
+        documents (List[Document]): Pages of the added and modified files.
+        document_topics (List[List[Tuple[int, float]]]): Topic distribution\
+            of each page.
+
+        Returns
+        -------
+        Tuple[QuestionBank, Set[int]]
+            Updated question bank, and the topics whose pages changed, that
+            is the topics of the previous and of the new pages of the changed
+            files.
+        """
+        # the pages of an added file may have been loaded already, if it was
+        # added while the directory was first loaded
+        replaced_sources = changes.added + changes.modified + changes.removed
+        changed_topics: Set[int] = set()
+        for source in replaced_sources:
+            changed_topics |= self.get_source_topics(source)
+        for topics in document_topics:
+            changed_topics |= {topic_index for topic_index, _ in topics}
+
+        if self.topic_filter:
+            documents = assign_topics_to_documents(documents, document_topics)
+        update_vector_store(
+            self.vector_store, documents, replaced_sources=replaced_sources
+        )
+
+        question_bank = copy.copy(self)
+        question_bank.page_topics = {
+            source: list(topics)
+            for source, topics in self.page_topics.items()
+            if source not in replaced_sources
+        }
+        question_bank._add_pages(documents, document_topics)
+        return question_bank, changed_topics